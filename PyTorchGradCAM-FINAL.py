@@ -348,6 +348,10 @@ import PIL
 
 model = model_ft.to(device)
 
+# Or use the TorchScript artifact written by export_model.py:
+# import model_registry
+# model = model_registry.load_cam_model("models/FULLRetrainedResNetModel.ts", device)
+
 # Get last convolutional layer of the model
 target_layers = [model.layer4[-1]]
 
@@ -0,0 +1,180 @@
+""" Classify a whole directory tree of X-rays with the retrained ResNet.
+
+Results are streamed to a JSONL or CSV file while the run is in progress,
+so an interrupted run can be continued with --resume.
+
+Example:
+    python batch_classify.py chest_xray/test --output predictions.jsonl --resume
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import torch
+from PIL import Image
+from torchvision.datasets.folder import IMG_EXTENSIONS
+
+import model_registry
+import predictor
+
+FIELDS = ['path', 'prediction'] + ['prob_' + name.lower() for name in model_registry.CLASS_NAMES]
+
+
+class ImagePathDataset(torch.utils.data.Dataset):
+    """ Decodes and preprocesses images by path, so decoding runs in the DataLoader workers. """
+
+    def __init__(self, paths, transform):
+        self.paths = paths
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        try:
+            with open(self.paths[index], 'rb') as f:
+                img = Image.open(f).convert('RGB')
+            return index, self.transform(img)
+        except Exception:
+            # Unreadable files are reported in the output instead of stopping the run
+            return index, None
+
+
+def collate(samples):
+    indices = [index for index, tensor in samples if tensor is not None]
+    failed = [index for index, tensor in samples if tensor is None]
+    tensors = [tensor for index, tensor in samples if tensor is not None]
+    batch = torch.stack(tensors) if tensors else None
+    return indices, batch, failed
+
+
+def find_images(root):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMG_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+def truncate_partial_line(output_path):
+    """ An interrupted run can leave half a line at the end of the file, drop it. """
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+def read_done_paths(output_path, output_format):
+    if not os.path.exists(output_path):
+        return set()
+    truncate_partial_line(output_path)
+    done = set()
+    with open(output_path, newline='') as f:
+        if output_format == 'csv':
+            for row in csv.DictReader(f):
+                done.add(row['path'])
+        else:
+            for line in f:
+                if line.strip():
+                    done.add(json.loads(line)['path'])
+    return done
+
+
+class ResultWriter:
+    def __init__(self, output_path, output_format, append):
+        self.output_format = output_format
+        write_header = not (append and os.path.exists(output_path) and os.path.getsize(output_path) > 0)
+        self.file = open(output_path, 'a' if append else 'w', newline='')
+        if output_format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=FIELDS + ['error'])
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, row):
+        if self.output_format == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def classify_directory(input_dir, output_path, output_format='jsonl', backend=predictor.BACKEND,
+                       batch_size=64, num_workers=4, resume=False, log_every=10):
+    device = model_registry.get_device()
+    xray_predictor = predictor.get_predictor(backend, device)
+
+    paths = find_images(input_dir)
+    done = read_done_paths(output_path, output_format) if resume else set()
+    paths = [path for path in paths if path not in done]
+    print(f'{len(done)} images already classified, {len(paths)} to go', file=sys.stderr)
+
+    dataset = ImagePathDataset(paths, model_registry.data_transforms['test'])
+    dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False,
+                                             num_workers=num_workers, collate_fn=collate,
+                                             pin_memory=device.type == 'cuda')
+
+    writer = ResultWriter(output_path, output_format, append=resume)
+    since = time.time()
+    processed = 0
+    try:
+        with torch.inference_mode():
+            for batch_number, (indices, images, failed) in enumerate(dataloader, 1):
+                if images is not None:
+                    predictions, probabilities = predictor.Predictor.postprocess(xray_predictor.predict_batch(images))
+                    for index, probs, prediction in zip(indices, probabilities, predictions):
+                        row = {'path': paths[index], 'prediction': prediction}
+                        for field, prob in zip(FIELDS[2:], probs):
+                            row[field] = round(float(prob), 6)
+                        writer.write(row)
+                for index in failed:
+                    writer.write({'path': paths[index], 'error': 'could not decode image'})
+                # Flush every batch, so an interrupted run loses at most one batch
+                writer.flush()
+
+                processed += len(indices) + len(failed)
+                if batch_number % log_every == 0:
+                    elapsed = time.time() - since
+                    print(f'{processed}/{len(paths)} images, {processed / elapsed:.1f} images/s', file=sys.stderr)
+    finally:
+        writer.close()
+
+    elapsed = time.time() - since
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f'Classified {processed} images in {elapsed:.1f}s ({rate:.1f} images/s)', file=sys.stderr)
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Classify a directory tree of chest X-rays.')
+    parser.add_argument('input_dir', help='Directory that is searched recursively for images')
+    parser.add_argument('--output', required=True, help='JSONL or CSV file the results are streamed to')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help='Output format, by default taken from the output file extension')
+    parser.add_argument('--backend', default=predictor.BACKEND, choices=sorted(predictor.BACKENDS) + ['auto'])
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, default=4, help='Parallel decode workers')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip images that are already in the output file and append to it')
+    args = parser.parse_args(argv)
+
+    output_format = args.format
+    if output_format is None:
+        output_format = 'csv' if args.output.lower().endswith('.csv') else 'jsonl'
+
+    classify_directory(args.input_dir, args.output, output_format, args.backend,
+                       args.batch_size, args.num_workers, args.resume)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+""" Latency, throughput and peak memory of every CAM method on the retrained ResNet-18.
+
+Every (method, batch size, resolution) cell runs in a fresh spawned process, so its
+peak RSS isn't hidden by an earlier cell. The target layer is layer4[-1]. ScoreCAM and
+AblationCAM run one forward pass per channel, so their cells are smaller by default:
+--slow-batch-sizes, --slow-warmup and --slow-repeats. The results
+are written as JSON; pass a previous result file as --baseline to flag cells whose
+median latency or peak RSS grew by more than --tolerance (the exit status is then 1).
+
+Example (from the repository root):
+    python -m benchmarks.cam_methods --output cam_baseline.json
+    python -m benchmarks.cam_methods --baseline cam_baseline.json --output cam_new.json
+    python -m benchmarks.cam_methods --random-weights --methods gradcam eigencam --repeats 3
+    python -m benchmarks.cam_methods --slow-batch-sizes 1 8 --slow-repeats 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+import torch
+import torchvision
+
+import model_registry
+from generate_cams import METHODS
+
+# One forward pass per channel (batch), these get the smaller --slow-* cells
+GRADIENT_FREE = ['scorecam', 'ablationcam']
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def load_model(model_path, random_weights, device):
+    if random_weights:
+        torch.manual_seed(0)
+        model = torchvision.models.resnet18(num_classes=len(model_registry.CLASS_NAMES))
+        return model.to(device).eval()
+    return model_registry.load_cam_model(model_path, device)
+
+
+def run_cell(method, batch_size, resolution, model_path, random_weights, warmup, repeats):
+    """ Runs in its own process. Returns the latencies of the repeats and the peak RSS. """
+    device = model_registry.get_device()
+    model = load_model(model_path, random_weights, device)
+    cam = METHODS[method](model=model, target_layers=[model.layer4[-1]], use_cuda=device.type == 'cuda')
+
+    torch.manual_seed(0)
+    input_tensor = torch.rand(batch_size, 3, resolution, resolution, device=device)
+    for _ in range(warmup):
+        cam(input_tensor=input_tensor)
+
+    latencies = []
+    for _ in range(repeats):
+        since = time.perf_counter()
+        cam(input_tensor=input_tensor)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        latencies.append(time.perf_counter() - since)
+
+    latencies = np.float64(latencies)
+    return {'method': method,
+            'batch_size': batch_size,
+            'resolution': resolution,
+            'latency_p50_s': float(np.percentile(latencies, 50)),
+            'latency_p90_s': float(np.percentile(latencies, 90)),
+            'latency_p99_s': float(np.percentile(latencies, 99)),
+            'images_per_s': float(batch_size / latencies.mean()),
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def cell_key(cell):
+    return cell['method'], cell['batch_size'], cell['resolution']
+
+
+def find_regressions(cells, baseline_cells, tolerance):
+    baseline = {cell_key(cell): cell for cell in baseline_cells}
+    regressions = []
+    for cell in cells:
+        reference = baseline.get(cell_key(cell))
+        if reference is None:
+            continue
+        for metric in ['latency_p50_s', 'peak_rss_mb']:
+            if cell[metric] > reference[metric] * (1 + tolerance):
+                regressions.append((cell_key(cell), metric, reference[metric], cell[metric]))
+    return regressions
+
+
+def environment():
+    return {'python': platform.python_version(),
+            'torch': torch.__version__,
+            'torchvision': torchvision.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CAM methods on the retrained ResNet-18.')
+    parser.add_argument('--methods', nargs='+', choices=sorted(METHODS), default=list(METHODS))
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[224, 320])
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--slow-batch-sizes', type=int, nargs='+', default=[1],
+                        help='Batch sizes of ScoreCAM and AblationCAM')
+    parser.add_argument('--slow-warmup', type=int, default=0)
+    parser.add_argument('--slow-repeats', type=int, default=2)
+    parser.add_argument('--model', default=model_registry.MODEL_PATH)
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Use an untrained ResNet-18 instead of --model')
+    parser.add_argument('--output', default='cam_methods.json')
+    parser.add_argument('--baseline', default=None, help='Earlier --output file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative growth of the median latency and the peak RSS')
+    args = parser.parse_args(argv)
+
+    # A fresh process per cell, so every cell gets its own peak RSS
+    context = multiprocessing.get_context('spawn')
+    cells = []
+    print(f'{"method":>20} {"batch":>5} {"res":>4} {"p50 s":>8} {"p90 s":>8} {"p99 s":>8} '
+          f'{"img/s":>7} {"RSS MB":>7}')
+    for method in args.methods:
+        slow = method in GRADIENT_FREE
+        batch_sizes = args.slow_batch_sizes if slow else args.batch_sizes
+        warmup, repeats = (args.slow_warmup, args.slow_repeats) if slow else (args.warmup, args.repeats)
+        for batch_size in batch_sizes:
+            for resolution in args.resolutions:
+                with context.Pool(1) as pool:
+                    cell = pool.apply(run_cell, (method, batch_size, resolution, args.model,
+                                                 args.random_weights, warmup, repeats))
+                cells.append(cell)
+                print(f'{method:>20} {batch_size:>5} {resolution:>4} {cell["latency_p50_s"]:>8.3f} '
+                      f'{cell["latency_p90_s"]:>8.3f} {cell["latency_p99_s"]:>8.3f} '
+                      f'{cell["images_per_s"]:>7.1f} {cell["peak_rss_mb"]:>7.0f}', flush=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(),
+                   'model': None if args.random_weights else args.model,
+                   'warmup': args.warmup,
+                   'repeats': args.repeats,
+                   'slow_warmup': args.slow_warmup,
+                   'slow_repeats': args.slow_repeats,
+                   'cells': cells}, f, indent=2)
+    print(f'Wrote {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(cells, baseline['cells'], args.tolerance)
+        for (method, batch_size, resolution), metric, before, after in regressions:
+            print(f'REGRESSION {method} batch {batch_size} res {resolution}: '
+                  f'{metric} {before:.3f} -> {after:.3f}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
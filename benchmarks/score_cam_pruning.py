@@ -0,0 +1,84 @@
+""" Speed / fidelity trade-off of channel-pruned ScoreCAM against full ScoreCAM.
+
+For every ranking and ratio the pruned maps are compared with the full maps of
+the same images (Pearson correlation and mean absolute difference of the
+normalized maps), next to the time per image and the speedup.
+
+Example (from the repository root):
+    python -m benchmarks.score_cam_pruning --images chest_xray/test --max-images 4
+    python -m benchmarks.score_cam_pruning --random-weights   # without the trained model
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import torch
+import torchvision
+from PIL import Image
+
+import batch_classify
+import inference
+import model_registry
+from pytorch_grad_cam import ScoreCAM
+
+
+def load_images(images, max_images):
+    paths = batch_classify.find_images(images)[:max_images]
+    if not paths:
+        sys.exit(f'No images found in {images}')
+    tensors = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            tensors.append(inference.image_to_tensor(Image.open(f).convert('RGB'))[0])
+    return torch.stack(tensors)
+
+
+def run_cam(model, input_tensor, batch_size, **kwargs):
+    cam = ScoreCAM(model=model, target_layers=[model.layer4[-1]], **kwargs)
+    cam.batch_size = batch_size
+    since = time.perf_counter()
+    grayscale_cams = cam(input_tensor=input_tensor)
+    return grayscale_cams, (time.perf_counter() - since) / len(input_tensor)
+
+
+def fidelity(reference, grayscale_cams):
+    correlations = [np.corrcoef(a.ravel(), b.ravel())[0, 1] for a, b in zip(reference, grayscale_cams)]
+    return float(np.mean(correlations)), float(np.abs(reference - grayscale_cams).mean())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark channel-pruned ScoreCAM.')
+    parser.add_argument('--images', default='img', help='Directory that is searched recursively for images')
+    parser.add_argument('--max-images', type=int, default=2)
+    parser.add_argument('--model', default=model_registry.MODEL_PATH)
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Use an untrained ResNet-18 instead of --model')
+    parser.add_argument('--ratios', type=float, nargs='+', default=[0.05, 0.1, 0.25, 0.5])
+    parser.add_argument('--rankings', nargs='+', choices=['energy', 'gradient'], default=['energy', 'gradient'])
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args(argv)
+
+    device = model_registry.get_device()
+    if args.random_weights:
+        torch.manual_seed(0)
+        model = torchvision.models.resnet18(num_classes=len(model_registry.CLASS_NAMES)).to(device).eval()
+    else:
+        model = model_registry.get_cam_model(args.model, device)
+    input_tensor = load_images(args.images, args.max_images).to(device)
+    use_cuda = device.type == 'cuda'
+
+    reference, full_time = run_cam(model, input_tensor, args.batch_size, use_cuda=use_cuda)
+    print(f'{"ranking":>8} {"ratio":>6} {"s/image":>8} {"speedup":>8} {"corr":>6} {"mae":>7}')
+    print(f'{"full":>8} {1.0:>6.2f} {full_time:>8.2f} {1.0:>8.1f} {1.0:>6.3f} {0.0:>7.4f}')
+    for ranking in args.rankings:
+        for ratio in args.ratios:
+            grayscale_cams, seconds = run_cam(model, input_tensor, args.batch_size, use_cuda=use_cuda,
+                                              ratio_channels_to_score=ratio, channel_ranking=ranking)
+            correlation, mae = fidelity(reference, grayscale_cams)
+            print(f'{ranking:>8} {ratio:>6.2f} {seconds:>8.2f} {full_time / seconds:>8.1f} '
+                  f'{correlation:>6.3f} {mae:>7.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+""" Prediction and Grad-CAM heatmap from a single forward and backward pass.
+
+GradCAM already runs the forward pass through the ActivationsAndGradients
+hooks and keeps the model outputs, so the logits come for free and an
+explanation only costs one extra backward pass.
+"""
+import threading
+
+import torch
+
+import inference
+import model_registry
+from pytorch_grad_cam import GradCAM
+
+# The CAM hooks are registered on a shared model, only one explanation at a time
+_lock = threading.Lock()
+
+
+def predict_with_cam(input_tensor, model, target_layers=None):
+    """ Returns the (B, 2) logits on the cpu and the (B, H, W) Grad-CAM maps
+        of the predicted class of every image. """
+    if target_layers is None:
+        # Last convolutional block of the ResNet
+        target_layers = [model.layer4[-1]]
+    with _lock:
+        with GradCAM(model=model, target_layers=target_layers) as cam:
+            grayscale_cam = cam(input_tensor=input_tensor)
+            logits = cam.outputs.detach().cpu()
+    return logits, grayscale_cam
+
+
+def predict_bytes_with_cam(image_bytes, model=None, device=None):
+    """ Class name, logits and Grad-CAM map for a single encoded image,
+        plus the cropped RGB image the map belongs to. """
+    if device is None:
+        device = model_registry.get_device()
+    if model is None:
+        model = model_registry.get_cam_model(device=device)
+
+    img = inference.decode_image(image_bytes)
+    input_tensor = inference.image_to_tensor(img).to(device)
+    logits, grayscale_cam = predict_with_cam(input_tensor, model)
+    predicted_class = model_registry.CLASS_NAMES[int(torch.argmax(logits[0]))]
+    return predicted_class, logits[0], grayscale_cam[0], inference.image_to_rgb(img)
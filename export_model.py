@@ -0,0 +1,69 @@
+""" Export the retrained ResNet as a frozen TorchScript artifact, or as ONNX.
+
+Conv+BatchNorm pairs are folded into single convolutions before the graph
+is scripted. The archive is frozen when it is loaded, and the Grad-CAM code
+(which needs module hooks) rebuilds a hookable eager model from the same
+weights with model_registry.load_cam_model.
+
+Examples:
+    python export_model.py --output models/FULLRetrainedResNetModel.ts
+    python export_model.py --format onnx --output models/FULLRetrainedResNetModel.onnx
+"""
+import argparse
+import json
+
+import torch
+
+import model_registry
+from model_registry import fuse_conv_bn
+
+
+def export_torchscript(model, output_path, arch='resnet18'):
+    """ Scripted fused model, frozen when model_registry.load_model loads it.
+        The archive holds the weights once: a frozen module inlines them as constants,
+        so the unfrozen module is saved and its state_dict is the eager CAM model's. """
+    model = fuse_conv_bn(model.cpu().eval())
+    metadata = {'arch': arch, 'num_classes': model.fc.out_features, 'freeze_on_load': True}
+    scripted = torch.jit.script(model)
+    torch.jit.save(scripted, output_path, _extra_files={'metadata.json': json.dumps(metadata)})
+    return torch.jit.freeze(scripted)
+
+
+def export_onnx(model, output_path):
+    """ ONNX graph with a dynamic batch dimension, for the onnxruntime backend in predictor.py. """
+    model = fuse_conv_bn(model.cpu().eval())
+    torch.onnx.export(model, torch.zeros(1, 3, 224, 224), output_path,
+                      input_names=['input'], output_names=['logits'],
+                      dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the retrained ResNet as frozen TorchScript.')
+    parser.add_argument('--model', default=model_registry.MODEL_PATH, help='Pickled nn.Module to export')
+    parser.add_argument('--output', default=None,
+                        help='Defaults to models/FULLRetrainedResNetModel.ts or .onnx, depending on --format')
+    parser.add_argument('--format', choices=['torchscript', 'onnx'], default='torchscript')
+    parser.add_argument('--arch', default='resnet18')
+    args = parser.parse_args(argv)
+
+    if args.output is None:
+        extension = '.ts' if args.format == 'torchscript' else '.onnx'
+        args.output = 'models/FULLRetrainedResNetModel' + extension
+
+    model = model_registry.load_model(args.model, torch.device('cpu'))
+    if args.format == 'onnx':
+        export_onnx(model, args.output)
+        print(f'Wrote {args.output}')
+        return
+
+    example = torch.rand(1, 3, 224, 224)
+    with torch.no_grad():
+        reference = model(example)
+        frozen = export_torchscript(model, args.output, args.arch)
+        # Folding BatchNorm only changes the result by floating point rounding
+        difference = (frozen(example) - reference).abs().max().item()
+    print(f'Wrote {args.output}, max abs difference to the eager model: {difference:.2e}')
+
+
+if __name__ == '__main__':
+    main()
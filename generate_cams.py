@@ -0,0 +1,176 @@
+""" Generate CAM overlays and raw maps for a whole directory tree of X-rays.
+
+Images are decoded in DataLoader workers, the CAM runs over whole batches, and
+the overlays (.jpeg) and raw maps (.npy) are written by a pool of threads while
+the next batch is computed. Images whose outputs already exist are skipped,
+so an interrupted run continues where it stopped. Images that can't be decoded
+are recorded in decode_errors.jsonl in the output directory and skipped as well.
+
+Example (the images in GradCam-Images were made like this, one by one):
+    python generate_cams.py chest_xray/test --output-dir GradCam-Images --aug-smooth
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+import batch_classify
+import inference
+import model_registry
+from pytorch_grad_cam import GradCAM, ScoreCAM, GradCAMPlusPlus, AblationCAM, XGradCAM, EigenCAM, \
+    EigenGradCAM, LayerCAM, FullGrad, GradCAMElementWise
+from pytorch_grad_cam.utils.image import show_cam_on_image
+from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
+
+METHODS = {
+    'gradcam': GradCAM,
+    'gradcam++': GradCAMPlusPlus,
+    'xgradcam': XGradCAM,
+    'layercam': LayerCAM,
+    'gradcamelementwise': GradCAMElementWise,
+    'eigencam': EigenCAM,
+    'eigengradcam': EigenGradCAM,
+    'scorecam': ScoreCAM,
+    'ablationcam': AblationCAM,
+    'fullgrad': FullGrad,
+}
+
+
+class CamDataset(torch.utils.data.Dataset):
+    """ Returns the network input and the cropped RGB image the CAM is drawn on. """
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        try:
+            with open(self.paths[index], 'rb') as f:
+                img = Image.open(f).convert('RGB')
+        except Exception:
+            return index, None, None
+        return index, inference.image_to_tensor(img)[0], torch.from_numpy(inference.image_to_rgb(img))
+
+
+def collate(samples):
+    failed = [sample[0] for sample in samples if sample[1] is None]
+    samples = [sample for sample in samples if sample[1] is not None]
+    if not samples:
+        return [], None, None, failed
+    indices, tensors, rgb_imgs = zip(*samples)
+    return list(indices), torch.stack(tensors), torch.stack(rgb_imgs), failed
+
+
+def output_paths(path, input_dir, output_dir, prefix):
+    relative = os.path.relpath(path, input_dir)
+    directory, filename = os.path.split(relative)
+    stem = os.path.splitext(filename)[0]
+    base = os.path.join(output_dir, directory, prefix + stem)
+    return base + '.jpeg', base + '.npy'
+
+
+def write_outputs(rgb_img, grayscale_cam, overlay_path, raw_path):
+    os.makedirs(os.path.dirname(overlay_path) or '.', exist_ok=True)
+    # BGR heatmap, as cv2.imwrite expects
+    visualization = show_cam_on_image(rgb_img, grayscale_cam, use_rgb=False)
+    cv2.imwrite(overlay_path, visualization)
+    if raw_path is not None:
+        np.save(raw_path, grayscale_cam)
+
+
+def generate_cams(input_dir, output_dir, method='gradcam', model_path=model_registry.MODEL_PATH,
+                  target_class=None, batch_size=16, num_workers=4, writer_threads=4,
+                  aug_smooth=False, eigen_smooth=False, save_raw=True):
+    device = model_registry.get_device()
+    model = model_registry.get_cam_model(model_path, device)
+    cam = METHODS[method](model=model, target_layers=[model.layer4[-1]], use_cuda=device.type == 'cuda')
+
+    prefix = ('AUGSMOOTH' if aug_smooth else '') + ('EIGENSMOOTH' if eigen_smooth else '')
+    os.makedirs(output_dir, exist_ok=True)
+    errors_path = os.path.join(output_dir, 'decode_errors.jsonl')
+    # Relative to input_dir, like the output paths
+    failed_before = batch_classify.read_done_paths(errors_path, 'jsonl')
+    paths = []
+    for path in batch_classify.find_images(input_dir):
+        overlay_path, raw_path = output_paths(path, input_dir, output_dir, prefix)
+        if os.path.relpath(path, input_dir) in failed_before:
+            continue
+        if not (os.path.exists(overlay_path) and (not save_raw or os.path.exists(raw_path))):
+            paths.append(path)
+    print(f'{len(paths)} images without a CAM yet, {len(failed_before)} skipped that could not be decoded',
+          file=sys.stderr)
+
+    dataloader = torch.utils.data.DataLoader(CamDataset(paths), batch_size=batch_size, shuffle=False,
+                                             num_workers=num_workers, collate_fn=collate)
+    since = time.time()
+    processed = 0
+    pending = set()
+    errors = batch_classify.ResultWriter(errors_path, 'jsonl', append=True)
+    try:
+        with ThreadPoolExecutor(writer_threads) as executor:
+            for indices, input_tensor, rgb_imgs, failed in dataloader:
+                for index in failed:
+                    errors.write({'path': os.path.relpath(paths[index], input_dir),
+                                  'error': 'could not decode image'})
+                errors.flush()
+                processed += len(failed)
+                if input_tensor is None:
+                    continue
+                targets = None
+                if target_class is not None:
+                    targets = [ClassifierOutputTarget(model_registry.CLASS_NAMES.index(target_class))] * len(indices)
+                grayscale_cams = cam(input_tensor=input_tensor.to(device), targets=targets,
+                                     aug_smooth=aug_smooth, eigen_smooth=eigen_smooth)
+
+                for index, rgb_img, grayscale_cam in zip(indices, rgb_imgs.numpy(), grayscale_cams):
+                    overlay_path, raw_path = output_paths(paths[index], input_dir, output_dir, prefix)
+                    pending.add(executor.submit(write_outputs, rgb_img, grayscale_cam, overlay_path,
+                                                raw_path if save_raw else None))
+                # Don't let finished maps pile up in memory if the disk is slower than the CAM
+                if len(pending) > 4 * batch_size:
+                    done, pending = wait(pending, return_when='FIRST_COMPLETED')
+                    for future in done:
+                        future.result()
+
+                processed += len(indices)
+                elapsed = time.time() - since
+                print(f'{processed}/{len(paths)} images, {processed / elapsed:.1f} images/s', file=sys.stderr)
+
+            for future in pending:
+                future.result()
+    finally:
+        errors.close()
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batched CAM generation for a directory tree of X-rays.')
+    parser.add_argument('input_dir')
+    parser.add_argument('--output-dir', default='GradCam-Images')
+    parser.add_argument('--method', choices=sorted(METHODS), default='gradcam')
+    parser.add_argument('--model', default=model_registry.MODEL_PATH)
+    parser.add_argument('--target-class', choices=model_registry.CLASS_NAMES, default=None,
+                        help='Explain this class instead of the predicted one')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--num-workers', type=int, default=4, help='Parallel decode workers')
+    parser.add_argument('--writer-threads', type=int, default=4, help='Threads writing overlays and maps')
+    parser.add_argument('--aug-smooth', action='store_true')
+    parser.add_argument('--eigen-smooth', action='store_true')
+    parser.add_argument('--no-raw', action='store_true', help="Don't write the raw .npy maps")
+    args = parser.parse_args(argv)
+
+    generate_cams(args.input_dir, args.output_dir, args.method, args.model, args.target_class,
+                  args.batch_size, args.num_workers, args.writer_threads,
+                  args.aug_smooth, args.eigen_smooth, not args.no_raw)
+
+
+if __name__ == '__main__':
+    main()
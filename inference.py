@@ -0,0 +1,25 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+import model_registry
+
+
+def decode_image(image_bytes):
+    """ Decode an uploaded file buffer in memory.
+        X-rays are often grayscale, convert them to RGB like ImageFolder does. """
+    img = Image.open(io.BytesIO(image_bytes))
+    return img.convert('RGB')
+
+
+def image_to_tensor(img):
+    """ Apply the 'test' preprocessing and add the batch dimension. """
+    return model_registry.data_transforms['test'](img).unsqueeze(0)
+
+
+def image_to_rgb(img):
+    """ The resized and cropped image the network sees, as float32 in [0, 1],
+        for drawing CAM overlays with show_cam_on_image. """
+    resize, crop = model_registry.data_transforms['test'].transforms[:2]
+    return np.float32(crop(resize(img))) / 255
@@ -0,0 +1,154 @@
+""" Standalone HTTP inference service for the pneumonia classifier.
+
+Concurrent requests are collected into micro-batches, so one forward pass
+serves many requests instead of one batch-size-1 forward per request.
+
+Example:
+    python inference_server.py --port 8000 --max-batch-size 32 --max-delay-ms 5
+    curl --data-binary @img/Normal-chest.jpeg http://localhost:8000/predict
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+import inference
+import model_registry
+import predictor
+
+
+class MicroBatcher:
+    """ Collects single-image requests into batches of at most max_batch_size.
+        A batch is run as soon as it is full, or max_delay seconds after its
+        first request arrived, whichever comes first. """
+
+    def __init__(self, xray_predictor, max_batch_size=32, max_delay=0.005):
+        self.predictor = xray_predictor
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, input_tensor):
+        """ Queue a preprocessed (3, H, W) tensor, returns a Future with its logits. """
+        future = Future()
+        self.requests.put((input_tensor, future))
+        return future
+
+    def collect_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect_batch()
+            tensors = [tensor for tensor, future in batch]
+            futures = [future for tensor, future in batch]
+            try:
+                logits = self.predictor.predict_batch(torch.stack(tensors))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, output in zip(futures, logits):
+                future.set_result(output)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    batcher = None
+    # Larger uploads are rejected before they are read
+    max_body_bytes = 20 * 1024 * 1024
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self.send_json(400, {'error': 'invalid Content-Length'})
+            return
+        if length > self.max_body_bytes:
+            # The body stays unread, so the connection can't be reused
+            self.close_connection = True
+            self.send_json(413, {'error': f'image larger than {self.max_body_bytes} bytes'})
+            return
+        try:
+            # Decoding and preprocessing run in the request threads, in parallel
+            input_tensor = inference.image_to_tensor(inference.decode_image(self.rfile.read(length)))[0]
+        except Exception:
+            self.send_json(400, {'error': 'could not decode image'})
+            return
+
+        try:
+            logits = self.batcher.submit(input_tensor).result()
+        except Exception:
+            self.send_json(500, {'error': 'prediction failed'})
+            return
+        predictions, probabilities = predictor.Predictor.postprocess(logits[None])
+        self.send_json(200, {
+            'prediction': predictions[0],
+            'probabilities': {name: float(prob) for name, prob in zip(model_registry.CLASS_NAMES, probabilities[0])},
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-batching HTTP server for the X-ray classifier.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--backend', default=predictor.BACKEND, choices=sorted(predictor.BACKENDS) + ['auto'])
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-delay-ms', type=float, default=5.0,
+                        help='How long the first request of a batch waits for others to join')
+    parser.add_argument('--max-body-mb', type=float, default=20.0, help='Largest accepted image upload')
+    args = parser.parse_args(argv)
+
+    xray_predictor = predictor.get_predictor(args.backend, model_registry.get_device())
+    PredictionHandler.max_body_bytes = int(args.max_body_mb * 1024 * 1024)
+    PredictionHandler.batcher = MicroBatcher(xray_predictor, args.max_batch_size, args.max_delay_ms / 1000)
+
+    server = ThreadingHTTPServer((args.host, args.port), PredictionHandler)
+    print(f'Serving on http://{args.host}:{args.port}/predict')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,12 @@ import os
 import torch.nn as nn
 from PIL import Image
 import pytorch_grad_cam
+import model_registry
+import predictor
+import prediction_cache
+import explanation
+import inference
+from pytorch_grad_cam.utils.image import show_cam_on_image
 
 with st.expander("Chest X-Ray Classification Team - A Brief Introduction"):
     def first_part():
@@ -291,6 +297,12 @@ with st.expander("Chapter 7: Performance, System and CO2 Emission"):
 with st.expander("Chapter 8: Interactive Prediction with our PyTorch Model"):
     st.title("Chapter 8: Interactive Prediction with our PyTorch Model")
     st.subheader("Upload An Image To Classify And Click The 'Predict' Button (Below The Appearing Uploaded Picture)")
+    # Loaded, validated and warmed up once per process, shared by every session.
+    # The runtime (pytorch, torchscript, onnxruntime or auto) is chosen with XRAY_BACKEND.
+    device = model_registry.get_device()
+    xray_predictor = predictor.get_predictor(device=device)
+    cache = prediction_cache.get_cache()
+
     @st.cache
     def load_image(image_file):
         img = Image.open(image_file)
@@ -302,92 +314,38 @@ with st.expander("Chapter 8: Interactive Prediction with our PyTorch Model"):
         st.write(file_details)
         img = load_image(image_file)
         st.image(img)
-        with open(os.path.join("tempDir/test/NORMAL/",image_file.name),"wb") as f: 
-          f.write(image_file.getbuffer())
-        with open(os.path.join("tempDir/test/PNEUMONIA/",image_file.name),"wb") as f: 
-          f.write(image_file.getbuffer()) 
-        st.success("Saved File")
 
+    show_heatmap = st.checkbox("Show Grad-CAM heatmap (computed in the same pass as the prediction)")
     col1, col2, col3, col4, col5 = st.columns(5)
     with col3:
         startButton = st.button("Predict")
 
 
-    if (startButton):
-        os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
-        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-
-
-        # In[2]:
-
-
-        # Data augmentation and normalization for training
-        # Just normalization for validation
-        data_transforms = {
-            'train': transforms.Compose([
-                transforms.RandomResizedCrop(224),
-                transforms.RandomHorizontalFlip(),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-            ]),
-            'test': transforms.Compose([
-                transforms.Resize(256),
-                transforms.CenterCrop(224),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-            ]),
-        }
-
-        # Directory of 'train' and 'test' folders
-        data_dir = 'tempDir/'
-
-        # Retrieving the images by folder
-        image_datasets = {x: datasets.ImageFolder(os.path.join(data_dir, x),
-                                                  data_transforms[x])
-                          for x in ['test']}
-
-        dataloaders = {x: torch.utils.data.DataLoader(image_datasets[x], batch_size=4,
-                                                     shuffle=True, num_workers=4)
-                      for x in ['test']}
-        class_names = image_datasets['test'].classes
-
-
-        # In[3]:
-
-
-        #model = models.resnet18()
-        model = torch.load("models/FULLRetrainedResNetModel.pt", map_location=torch.device('cpu'))
-        num_ftrs = model.fc.in_features
-
-        # Here the size of each output sample is set to 2.
-        model.fc = nn.Linear(num_ftrs, 2)
-
-        #model.load_state_dict(torch.load("models/FULLRetrainedResNetModel.pt", map_location=torch.device('cpu')))
-
-        model = model.to(device)
-
-
-        # In[4]:
-
-
-        number_of_predictions = 1
-
-        with torch.no_grad():
-            model.eval()
-            for data in dataloaders['test']:
-                images, labels = data
-
-                plt.imshow(np.squeeze(images[0][0:1]), cmap='gray')
-
-                images = images.to(device)
-                labels = labels.to(device)
-
-                pred_outputs = model(images)
-                predicted = torch.argmax(pred_outputs.data, 1)
-
-        #print('True Value: ', ' '.join('%s' % class_names[predicted[j]] for j in range(number_of_predictions)))
-        print('Predicted: ', ' '.join('%s' % class_names[predicted[0]] for j in range(number_of_predictions)))
-        st.warning(class_names[predicted[0]])
+    if (startButton and image_file is not None):
+        # Re-uploads of the same study are answered from the cache, without a forward pass
+        image_bytes = image_file.getvalue()
+        if show_heatmap:
+            # The heatmap needs the hookable eager model, not the predictor backend
+            key = prediction_cache.cache_key(image_bytes, model_registry.file_checksum(model_registry.MODEL_PATH))
+            entry = cache.get(key)
+            if entry is None or entry['cam'] is None:
+                predicted_class, logits, grayscale_cam, rgb_img = explanation.predict_bytes_with_cam(image_bytes)
+                entry = cache.put(key, logits.numpy(), predicted_class, grayscale_cam)
+        else:
+            key = prediction_cache.cache_key(image_bytes, xray_predictor.checksum)
+            entry = cache.get(key)
+            if entry is None:
+                # Decode the upload in memory and classify it with a single forward pass
+                predicted_class, logits = xray_predictor.predict_bytes(image_bytes)
+                entry = cache.put(key, logits.numpy(), predicted_class)
+        predicted_class = entry['predicted_class']
+
+        print('Predicted: ', predicted_class)
+        st.warning(predicted_class)
+        if show_heatmap:
+            rgb_img = inference.image_to_rgb(inference.decode_image(image_bytes))
+            st.image(show_cam_on_image(rgb_img, entry['cam'], use_rgb=True),
+                     caption="Grad-CAM of the predicted class (last convolutional block)")
 
         # In[ ]:
    
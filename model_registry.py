@@ -0,0 +1,205 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+
+import torch
+import torch.nn as nn
+import torchvision
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torchvision import transforms
+
+# Fix for a bug that sometimes appeared using matplotlib
+os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
+
+# Retrained ResNet18 from PyTorchGradCAM-FINAL.py, or an artifact written by export_model.py
+MODEL_PATH = os.environ.get("XRAY_MODEL_PATH", "models/FULLRetrainedResNetModel.pt")
+
+# Folder names of the ImageFolder layout, in the order ImageFolder sorts them
+CLASS_NAMES = ['NORMAL', 'PNEUMONIA']
+
+# Just normalization for validation, same as the 'test' transform used for training
+data_transforms = {
+    'test': transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ]),
+}
+
+_models = {}
+_cam_models = {}
+_checksums = {}
+_lock = threading.Lock()
+
+
+def get_device():
+    return torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+
+def validate_model(model, device):
+    """ Make sure the loaded network is the 2-class classifier the app expects.
+        Frozen TorchScript artifacts have no 'fc' attribute, so check the output shape. """
+    if not isinstance(model, (nn.Module, torch.jit.ScriptModule)):
+        raise TypeError(f"Expected a torch.nn.Module, got {type(model).__name__}")
+    with torch.no_grad():
+        output = model(torch.zeros(1, 3, 224, 224, device=device))
+    if tuple(output.shape) != (1, len(CLASS_NAMES)):
+        raise ValueError(
+            f"Expected a {len(CLASS_NAMES)}-class classifier, got an output of shape {tuple(output.shape)}")
+
+
+def is_torchscript(path):
+    """ TorchScript archives contain the serialized code next to the weights. """
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(name.split('/')[1:2] == ['code'] for name in archive.namelist())
+
+
+def is_quantized(path):
+    """ INT8 archives written by quantize_model.py call the quantized kernels in their code. """
+    if not is_torchscript(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(b'quantized' in archive.read(name)
+                   for name in archive.namelist() if name.split('/')[1:2] == ['code'])
+
+
+def model_device(path, device=None):
+    """ The device to load the model at path on: the requested one, by default get_device(),
+        but always the cpu for quantized models, their kernels don't run on the gpu. """
+    if is_quantized(path):
+        return torch.device('cpu')
+    return torch.device(device) if device is not None else get_device()
+
+
+def read_metadata(extra_files):
+    """ The metadata.json export_model.py stores in the archive, {} for other archives. """
+    return json.loads(extra_files['metadata.json'] or '{}')
+
+
+def file_checksum(path):
+    """ sha256 of a model file, computed once per process and path. """
+    key = os.path.abspath(path)
+    with _lock:
+        if key not in _checksums:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            _checksums[key] = digest.hexdigest()
+        return _checksums[key]
+
+
+def warmup(model, device, runs=1):
+    """ Run a few dummy forward passes, so the first real request
+        doesn't pay for lazy initialization and allocator growth. """
+    dummy = torch.zeros(1, 3, 224, 224, device=device)
+    with torch.no_grad():
+        for _ in range(runs):
+            model(dummy)
+
+
+def model_from_state_dict(state_dict, arch='resnet18'):
+    """ torchvision ResNet with the retrained weights, the number of classes is taken from the fc layer. """
+    model = getattr(torchvision.models, arch)(num_classes=state_dict['fc.weight'].shape[0])
+    model.load_state_dict(state_dict)
+    return model
+
+
+def fuse_conv_bn(module):
+    """ Fold every BatchNorm2d that directly follows a Conv2d (in module registration order)
+        into that convolution, and replace the BatchNorm2d by an Identity.
+        This matches how the torchvision ResNets are built: conv1/bn1, conv2/bn2
+        and the downsample Sequential(conv, bn). The module has to be in eval mode. """
+    previous_name, previous = None, None
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.BatchNorm2d) and isinstance(previous, torch.nn.Conv2d):
+            setattr(module, previous_name, fuse_conv_bn_eval(previous, child))
+            setattr(module, name, torch.nn.Identity())
+        else:
+            fuse_conv_bn(child)
+        previous_name, previous = name, child
+    return module
+
+
+def build_fused_resnet(arch='resnet18', num_classes=2):
+    """ Empty ResNet with the same structure fuse_conv_bn produces. """
+    model = getattr(torchvision.models, arch)(num_classes=num_classes)
+    return fuse_conv_bn(model.eval())
+
+
+def load_model(path=MODEL_PATH, device=None):
+    """ Load, validate and warm up the retrained ResNet. Prefer get_model(),
+        which only does this once per process. """
+    device = model_device(path, device)
+    if is_torchscript(path):
+        extra_files = {'metadata.json': ''}
+        model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+        if read_metadata(extra_files).get('freeze_on_load'):
+            model = torch.jit.freeze(model.eval())
+    else:
+        # A pickled nn.Module (as PyTorchGradCAM-FINAL.py saves it) or a state_dict.
+        # Unpickling a module needs weights_only=False, the file is our own local checkpoint.
+        model = torch.load(path, map_location=device, weights_only=False)
+        if isinstance(model, dict):
+            model = model_from_state_dict(model)
+    model = model.to(device)
+    model.eval()
+    validate_model(model, device)
+    warmup(model, device)
+    return model
+
+
+def load_cam_model(path=MODEL_PATH, device=None):
+    """ Load an eager nn.Module that Grad-CAM can register hooks on.
+        For TorchScript artifacts written by export_model.py the fused
+        eager model is rebuilt from the weights stored in the archive. """
+    if device is None:
+        device = get_device()
+    if not is_torchscript(path):
+        return load_model(path, device)
+
+    extra_files = {'fused_state_dict': '', 'metadata.json': ''}
+    scripted = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    metadata = read_metadata(extra_files)
+    if extra_files['fused_state_dict']:
+        # Archives of earlier versions of export_model.py, frozen with a copy of the weights
+        state_dict = torch.load(io.BytesIO(extra_files['fused_state_dict']), map_location='cpu')
+    elif metadata.get('freeze_on_load'):
+        state_dict = scripted.state_dict()
+    else:
+        raise ValueError(f"{path} was not written by export_model.py, it has no eager weights")
+    model = build_fused_resnet(metadata['arch'], metadata['num_classes'])
+    model.load_state_dict(state_dict)
+    model = model.to(device)
+    model.eval()
+    validate_model(model, device)
+    return model
+
+
+def get_model(path=MODEL_PATH, device=None):
+    """ Process-wide registry: every caller (e.g. every Streamlit session)
+        gets the same eval-mode instance, loaded on first use. """
+    device = model_device(path, device)
+    key = (os.path.abspath(path), str(device))
+    with _lock:
+        if key not in _models:
+            _models[key] = load_model(path, device)
+        return _models[key]
+
+
+def get_cam_model(path=MODEL_PATH, device=None):
+    """ Process-wide hookable model for Grad-CAM. This is a separate instance from
+        get_model(), so the CAM hooks never see forward passes of plain predictions. """
+    if device is None:
+        device = get_device()
+    key = (os.path.abspath(path), str(device))
+    with _lock:
+        if key not in _cam_models:
+            _cam_models[key] = load_cam_model(path, device)
+        return _cam_models[key]
@@ -0,0 +1,152 @@
+""" Content-addressed cache for predictions (and optional Grad-CAM maps) of uploaded X-rays.
+
+Entries are keyed by a hash of the image bytes, the model checksum and the
+preprocessing config, so re-uploading the same study skips the forward pass,
+while a new model or a changed transform can never return a stale result.
+A bounded in-memory LRU sits in front of an on-disk store that evicts the
+least recently used files once it grows past max_bytes.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import model_registry
+
+CACHE_DIR = os.environ.get("XRAY_CACHE_DIR", ".cache/predictions")
+# Once over max_bytes, the disk store is trimmed down to this fraction of it
+EVICT_TO_FRACTION = 0.9
+
+# The repr of the Compose lists every transform with its parameters
+PREPROCESSING_CONFIG = repr(model_registry.data_transforms['test'])
+
+
+def cache_key(image_bytes, model_checksum, preprocessing=PREPROCESSING_CONFIG):
+    digest = hashlib.sha256()
+    for part in [image_bytes, model_checksum.encode('utf-8'), preprocessing.encode('utf-8')]:
+        # Length prefixes keep the concatenation unambiguous
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    def __init__(self, directory=CACHE_DIR, max_entries=256, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # Files on disk, least recently used first, and their total size in bytes
+        self.files = OrderedDict()
+        self.total_bytes = 0
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.scan()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """ Returns a dict with 'logits', 'predicted_class' and 'cam' (None if not computed), or None. """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        if self.directory is None or not os.path.exists(self.path(key)):
+            return None
+        try:
+            with np.load(self.path(key)) as data:
+                entry = {'logits': data['logits'],
+                         'predicted_class': str(data['predicted_class']),
+                         'cam': data['cam'] if 'cam' in data else None}
+            # Mark as recently used for the disk eviction
+            os.utime(self.path(key))
+        except (OSError, ValueError, KeyError):
+            # Evicted by another process in between, or a half-written file
+            return None
+        with self.lock:
+            if key + '.npz' in self.files:
+                self.files.move_to_end(key + '.npz')
+        self.remember(key, entry)
+        return entry
+
+    def put(self, key, logits, predicted_class, cam=None):
+        entry = {'logits': np.asarray(logits, dtype=np.float32),
+                 'predicted_class': predicted_class,
+                 'cam': None if cam is None else np.asarray(cam, dtype=np.float32)}
+        self.remember(key, entry)
+        if self.directory is not None:
+            self.write(key, entry)
+        return entry
+
+    def remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def write(self, key, entry):
+        arrays = {'logits': entry['logits'], 'predicted_class': np.array(entry['predicted_class'])}
+        if entry['cam'] is not None:
+            arrays['cam'] = entry['cam']
+        # Write to a temporary file first, so readers never see a partial entry
+        temporary_path = self.path(key) + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            np.savez(f, **arrays)
+            size = f.tell()
+        os.replace(temporary_path, self.path(key))
+
+        with self.lock:
+            self.total_bytes += size - self.files.pop(key + '.npz', 0)
+            self.files[key + '.npz'] = size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def scan(self):
+        """ Rebuild the index of the files on disk, ordered by their modification time. """
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name, stat.st_size))
+
+        self.files = OrderedDict((name, size) for mtime, name, size in sorted(files))
+        self.total_bytes = sum(self.files.values())
+
+    def evict(self):
+        """ Remove the least recently used files until the store fits in max_bytes.
+        Called with the lock held, only once the tracked total is over max_bytes. """
+        # Other processes may share the directory: rescan before deleting anything,
+        # so that their writes and reads count too
+        self.scan()
+        # Leave some headroom, so that the next puts don't rescan right away
+        target_bytes = self.max_bytes * EVICT_TO_FRACTION
+        while self.total_bytes > target_bytes and self.files:
+            name, size = self.files.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            self.total_bytes -= size
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get_cache():
+    """ Process-wide cache, shared by every Streamlit session. """
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = PredictionCache()
+        return _cache
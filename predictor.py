@@ -0,0 +1,165 @@
+""" One Predictor interface over interchangeable inference backends.
+
+Every backend takes the same preprocessed (B, 3, 224, 224) batch and returns
+(B, 2) logits, so preprocessing (inference.py) and post-processing live here
+once. The backend is picked with XRAY_BACKEND ('pytorch', 'torchscript',
+'onnxruntime' or 'auto'); 'auto' benchmarks every available backend on this
+host and keeps the fastest one.
+"""
+import os
+import threading
+import time
+import warnings
+
+import numpy as np
+import torch
+
+import inference
+import model_registry
+
+TORCHSCRIPT_PATH = os.environ.get("XRAY_TORCHSCRIPT_PATH", "models/FULLRetrainedResNetModel.ts")
+ONNX_PATH = os.environ.get("XRAY_ONNX_PATH", "models/FULLRetrainedResNetModel.onnx")
+BACKEND = os.environ.get("XRAY_BACKEND", "pytorch")
+
+
+class TorchBackend:
+    """ Eager PyTorch, the pickled nn.Module from the model registry. """
+    name = 'pytorch'
+
+    def __init__(self, path=model_registry.MODEL_PATH, device=None):
+        self.path = path
+        self.device = model_registry.model_device(path, device)
+        self.model = model_registry.get_model(path, self.device)
+
+    def __call__(self, batch):
+        with torch.inference_mode():
+            return self.model(batch.to(self.device)).cpu()
+
+
+class TorchScriptBackend(TorchBackend):
+    """ Frozen TorchScript artifact written by export_model.py. """
+    name = 'torchscript'
+
+    def __init__(self, path=TORCHSCRIPT_PATH, device=None):
+        super(TorchScriptBackend, self).__init__(path, device)
+
+
+class OnnxRuntimeBackend:
+    """ ONNX Runtime session for the artifact written by export_model.py --format onnx. """
+    name = 'onnxruntime'
+
+    def __init__(self, path=ONNX_PATH, device=None):
+        # Optional dependency, only needed for this backend
+        import onnxruntime
+        self.path = path
+        providers = ['CPUExecutionProvider']
+        if device is not None and torch.device(device).type == 'cuda':
+            providers.insert(0, 'CUDAExecutionProvider')
+        self.session = onnxruntime.InferenceSession(path, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {self.input_name: batch.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+BACKENDS = {backend.name: backend for backend in [TorchBackend, TorchScriptBackend, OnnxRuntimeBackend]}
+
+
+class Predictor:
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def checksum(self):
+        """ sha256 of the artifact the backend runs, e.g. for cache keys. """
+        return model_registry.file_checksum(self.backend.path)
+
+    def predict_batch(self, batch):
+        """ Logits for an already preprocessed batch, as a (B, 2) cpu tensor. """
+        return self.backend(batch)
+
+    def predict_images(self, images):
+        """ Class names and probabilities for a list of PIL images. """
+        batch = torch.cat([inference.image_to_tensor(img) for img in images])
+        return self.postprocess(self.predict_batch(batch))
+
+    def predict_bytes(self, image_bytes):
+        """ Class name and logits for a single encoded image. """
+        logits = self.predict_batch(inference.image_to_tensor(inference.decode_image(image_bytes)))[0]
+        return model_registry.CLASS_NAMES[int(torch.argmax(logits))], logits
+
+    @staticmethod
+    def postprocess(logits):
+        probabilities = torch.softmax(logits, dim=1)
+        predicted = torch.argmax(probabilities, dim=1)
+        return [model_registry.CLASS_NAMES[p] for p in predicted], probabilities
+
+
+def available_backends(device=None):
+    """ Instantiate every backend whose artifact and runtime are present on this host.
+        Backends without an artifact are skipped, the ones that fail to load with a warning. """
+    candidates = [(TorchBackend, model_registry.MODEL_PATH),
+                  (TorchScriptBackend, TORCHSCRIPT_PATH),
+                  (OnnxRuntimeBackend, ONNX_PATH)]
+    backends = []
+    for backend_class, path in candidates:
+        if not os.path.exists(path):
+            continue
+        try:
+            backends.append(backend_class(path, device))
+        except ImportError:
+            pass
+        except Exception as e:
+            warnings.warn(f"Skipping the {backend_class.name} backend, {path} could not be loaded: {e}")
+    return backends
+
+
+def benchmark_backends(backends, batch_size=1, runs=20, warmup_runs=3):
+    """ Median latency in seconds of one forward pass for every backend. """
+    batch = torch.zeros(batch_size, 3, 224, 224)
+    results = {}
+    for backend in backends:
+        for _ in range(warmup_runs):
+            backend(batch)
+        timings = []
+        for _ in range(runs):
+            since = time.perf_counter()
+            backend(batch)
+            timings.append(time.perf_counter() - since)
+        results[backend.name] = float(np.median(timings))
+    return results
+
+
+def fastest_backend(backends, batch_size=1, runs=20):
+    if not backends:
+        raise FileNotFoundError(
+            "No inference backend could be loaded, none of these models exists or loads: "
+            f"{model_registry.MODEL_PATH}, {TORCHSCRIPT_PATH}, {ONNX_PATH}")
+    if len(backends) == 1:
+        return backends[0]
+    results = benchmark_backends(backends, batch_size, runs)
+    fastest = min(results, key=results.get)
+    return next(backend for backend in backends if backend.name == fastest)
+
+
+_predictors = {}
+_lock = threading.Lock()
+
+
+def get_predictor(backend=BACKEND, device=None):
+    """ Process-wide Predictor for the configured backend, created on first use. """
+    key = (backend, str(device))
+    with _lock:
+        if key not in _predictors:
+            if backend == 'auto':
+                instance = fastest_backend(available_backends(device))
+            else:
+                instance = BACKENDS[backend](device=device)
+            _predictors[key] = Predictor(instance)
+        return _predictors[key]
+
+
+if __name__ == '__main__':
+    for name, seconds in benchmark_backends(available_backends()).items():
+        print(f'{name}: {seconds * 1000:.2f} ms per image')
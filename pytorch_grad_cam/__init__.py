@@ -10,6 +10,7 @@ from pytorch_grad_cam.eigen_cam import EigenCAM
 from pytorch_grad_cam.eigen_grad_cam import EigenGradCAM
 from pytorch_grad_cam.fullgrad_cam import FullGrad
 from pytorch_grad_cam.guided_backprop import GuidedBackpropReLUModel
+from pytorch_grad_cam.guided_grad_cam import GuidedGradCAM
 from pytorch_grad_cam.activations_and_gradients import ActivationsAndGradients
 import pytorch_grad_cam.utils.model_targets
 import pytorch_grad_cam.utils.reshape_transforms
\ No newline at end of file
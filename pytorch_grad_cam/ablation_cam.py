@@ -1,9 +1,10 @@
 import numpy as np
 import torch
-import tqdm
 from typing import Callable, List
 from pytorch_grad_cam.base_cam import BaseCAM
 from pytorch_grad_cam.utils.find_layers import replace_layer_recursive
+from pytorch_grad_cam.utils.model_split import get_model_tail
+from pytorch_grad_cam.utils.parallel import parallel_map
 from pytorch_grad_cam.ablation_layer import AblationLayer
 
 
@@ -13,14 +14,17 @@ https://openaccess.thecvf.com/content_WACV_2020/papers/Desai_Ablation-CAM_Visual
 Ablate individual activations, and then measure the drop in the target score.
 
 In the current implementation, the target layer activations is cached, so it won't be re-computed.
-However layers before it, if any, will not be cached.
-This means that if the target layer is a large block, for example model.featuers (in vgg), there will
-be a large save in run time.
+If the model can be split at the target layer with torch.fx (see utils/model_split.py), the ablated
+activations are only passed through the part of the model after it, for example avgpool + fc for
+layer4 of a ResNet. Otherwise the whole model runs for every ablation batch, and layers before
+the target layer are re-computed.
 
 Since we have to go over many channels and ablate them, and every channel ablation requires a forward pass,
 it would be nice if we could avoid doing that for channels that won't contribute anwyay, making it much faster.
 The parameter ratio_channels_to_ablate controls how many channels should be ablated, using an experimental method
 (to be improved). The default 1.0 value means that all channels will be ablated.
+
+On cpu hosts the channel batches can be spread over num_workers forked processes.
 """
 
 
@@ -32,7 +36,8 @@ class AblationCAM(BaseCAM):
                  reshape_transform: Callable = None,
                  ablation_layer: torch.nn.Module = AblationLayer(),
                  batch_size: int = 32,
-                 ratio_channels_to_ablate: float = 1.0) -> None:
+                 ratio_channels_to_ablate: float = 1.0,
+                 num_workers: int = 1) -> None:
 
         super(AblationCAM, self).__init__(model,
                                           target_layers,
@@ -42,6 +47,8 @@ class AblationCAM(BaseCAM):
         self.batch_size = batch_size
         self.ablation_layer = ablation_layer
         self.ratio_channels_to_ablate = ratio_channels_to_ablate
+        self.model_tails = {}
+        self.num_workers = num_workers
 
     def save_activation(self, module, input, output) -> None:
         """ Helper function to save the raw activations from the target layer """
@@ -77,58 +84,93 @@ class AblationCAM(BaseCAM):
                         targets: List[Callable],
                         activations: torch.Tensor,
                         grads: torch.Tensor) -> np.ndarray:
-        
+        if torch.is_tensor(activations):
+            # Channel selection below is done in numpy
+            activations = activations.cpu().numpy()
+
         # Do a forward pass, compute the target scores, and cache the activations
         handle = target_layer.register_forward_hook(self.save_activation)
         with torch.no_grad():
             outputs = self.model(input_tensor)
             handle.remove()
             original_scores = np.float32([target(output).cpu().item() for target, output in zip(targets, outputs)])
+            tail = self.get_model_tail(target_layer, outputs)
 
-        # Replace the layer with the ablation layer.
-        # When we finish, we will replace it back, so the original model is unchanged.
         ablation_layer = self.ablation_layer
-        replace_layer_recursive(self.model, target_layer, ablation_layer)
+        if tail is None:
+            # Replace the layer with the ablation layer.
+            # When we finish, we will replace it back, so the original model is unchanged.
+            replace_layer_recursive(self.model, target_layer, ablation_layer)
 
         number_of_channels = activations.shape[1]
+
+        ablation_layer.projection_method = self.projection_method
+        ablation_layer.projection_tol = self.projection_tol
+        # Check which channels should be ablated. Normally this will be all channels,
+        # But we can also try to speed this up by using a low ratio_channels_to_ablate.
+        channels_to_ablate = [ablation_layer.activations_to_be_ablated(activations[batch_index, :],
+                                                                       self.ratio_channels_to_ablate)
+                              for batch_index in range(len(targets))]
+
+        def ablate_batch(task):
+            batch_index, i = task
+            # This is a "gradient free" method, so we don't need gradients here.
+            with torch.no_grad():
+                channels = channels_to_ablate[batch_index][i: i + self.batch_size]
+                # Change the state of the ablation layer so it ablates the next channels.
+                # TBD: Move this into the ablation layer forward pass.
+                ablation_layer.set_next_batch(input_batch_index=batch_index,
+                                              activations=self.activations,
+                                              num_channels_to_ablate=len(channels))
+                ablation_layer.indices = channels
+                if tail is None:
+                    ablated_outputs = self.model(input_tensor[batch_index].repeat(len(channels), 1, 1, 1))
+                else:
+                    ablated_outputs = tail(ablation_layer(None))
+                return [targets[batch_index](o).cpu().item() for o in ablated_outputs]
+
+        # Ablate the activations of every image in the batch,
+        # with num_workers > 1 in parallel processes, see utils/parallel.py.
+        tasks = [(batch_index, i) for batch_index in range(len(targets))
+                 for i in range(0, len(channels_to_ablate[batch_index]), self.batch_size)]
+        tensors = [input_tensor] + ([self.activations] if torch.is_tensor(self.activations) else [])
+        batch_scores = parallel_map(ablate_batch, tasks, self.num_workers, tensors=tensors,
+                                    profiler=self.profiler, name='ablation_batch')
+
         weights = []
-        # This is a "gradient free" method, so we don't need gradients here.
-        with torch.no_grad():
-            # Loop over each of the batch images and ablate activations for it.
-            for batch_index, (target, tensor) in enumerate(zip(targets, input_tensor)):
-                new_scores = []
-                batch_tensor = tensor.repeat(self.batch_size, 1, 1, 1)
-
-                # Check which channels should be ablated. Normally this will be all channels,
-                # But we can also try to speed this up by using a low ratio_channels_to_ablate.
-                channels_to_ablate = ablation_layer.activations_to_be_ablated(activations[batch_index, :],
-                                                                              self.ratio_channels_to_ablate)
-                number_channels_to_ablate = len(channels_to_ablate)
-
-                for i in tqdm.tqdm(range(0, number_channels_to_ablate, self.batch_size)):
-                    if i + self.batch_size > number_channels_to_ablate:
-                        batch_tensor = batch_tensor[:(number_channels_to_ablate - i)]
-
-                    # Change the state of the ablation layer so it ablates the next channels.
-                    # TBD: Move this into the ablation layer forward pass.
-                    ablation_layer.set_next_batch(input_batch_index=batch_index,
-                                                  activations=self.activations,
-                                                  num_channels_to_ablate=batch_tensor.size(0))
-                    score = [target(o).cpu().item() for o in self.model(batch_tensor)]
-                    new_scores.extend(score)
-                    ablation_layer.indices = ablation_layer.indices[batch_tensor.size(0):]
-
-                new_scores = self.assemble_ablation_scores(new_scores,
-                                                           original_scores[batch_index],
-                                                           channels_to_ablate,
-                                                           number_of_channels)
-                weights.extend(new_scores)
+        for batch_index in range(len(targets)):
+            new_scores = [score for (index, i), scores in zip(tasks, batch_scores) if index == batch_index
+                          for score in scores]
+            new_scores = self.assemble_ablation_scores(new_scores,
+                                                       original_scores[batch_index],
+                                                       channels_to_ablate[batch_index],
+                                                       number_of_channels)
+            weights.extend(new_scores)
 
         weights = np.float32(weights)
         weights = weights.reshape(activations.shape[:2])
         original_scores = original_scores[:, None]
         weights = (original_scores - weights) / original_scores
 
-        # Replace the model back to the original state
-        replace_layer_recursive(self.model, ablation_layer, target_layer)
+        if tail is None:
+            # Replace the model back to the original state
+            replace_layer_recursive(self.model, ablation_layer, target_layer)
         return weights
+
+    def get_model_tail(self, target_layer: torch.nn.Module, outputs: torch.Tensor):
+        """ The part of the model after target_layer, or None if the model can't be split there.
+            Checked against the outputs of the full forward pass on the cached activations. """
+        if target_layer not in self.model_tails:
+            self.model_tails[target_layer] = get_model_tail(self.model, target_layer)
+        tail = self.model_tails[target_layer]
+        if tail is None or not torch.is_tensor(self.activations):
+            return None
+        try:
+            tail_outputs = tail(self.activations)
+        except Exception:
+            return None
+        if not torch.is_tensor(outputs) or not torch.is_tensor(tail_outputs) or \
+                tail_outputs.shape != outputs.shape or \
+                not torch.allclose(tail_outputs, outputs, rtol=1e-4, atol=1e-5):
+            return None
+        return tail
@@ -7,6 +7,9 @@ from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection
 class AblationLayer(torch.nn.Module):
     def __init__(self):
         super(AblationLayer, self).__init__()
+        # Solver of get_2d_projection, AblationCAM sets its own projection options here
+        self.projection_method = 'svd'
+        self.projection_tol = None
 
     def objectiveness_mask_from_svd(self, activations, threshold=0.01):
         """ Experimental method to get a binary mask to compare if the activation is worth ablating.
@@ -15,7 +18,9 @@ class AblationLayer(torch.nn.Module):
             Areas that are masked out, are probably not interesting anyway.
         """
 
-        projection = get_2d_projection(activations[None, :])[0, :]
+        projection = get_2d_projection(activations[None, :],
+                                       method=self.projection_method,
+                                       tol=self.projection_tol)[0, :]
         projection = np.abs(projection)
         projection = projection - projection.min()
         projection = projection / projection.max()
@@ -56,21 +61,27 @@ class AblationLayer(torch.nn.Module):
         """
         self.activations = activations[input_batch_index, :, :, :].clone().unsqueeze(0).repeat(num_channels_to_ablate, 1, 1, 1)
 
+    def ablate(self, output):
+        """ Ablate channel self.indices[i] of batch member i, for the whole batch at once. """
+        rows = torch.arange(output.size(0), device=output.device)
+        channels = torch.as_tensor(np.asarray(self.indices[:output.size(0)]),
+                                   dtype=torch.long, device=output.device)
+
+        # Commonly the minimum activation will be 0,
+        # And then it makes sense to zero it out.
+        # However depending on the architecture,
+        # If the values can be negative, we use very negative values
+        # to perform the ablation, deviating from the paper.
+        minimum = torch.min(output)
+        if minimum == 0:
+            output[rows, channels] = 0
+        else:
+            ABLATION_VALUE = 1e7
+            output[rows, channels] = minimum - ABLATION_VALUE
+
     def __call__(self, x):
         output = self.activations
-        for i in range(output.size(0)):
-            # Commonly the minimum activation will be 0,
-            # And then it makes sense to zero it out.
-            # However depending on the architecture,
-            # If the values can be negative, we use very negative values
-            # to perform the ablation, deviating from the paper.
-            if torch.min(output) == 0:
-                output[i, self.indices[i], :] = 0
-            else:
-                ABLATION_VALUE = 1e7
-                output[i, self.indices[i], :] = torch.min(
-                    output) - ABLATION_VALUE
-
+        self.ablate(output)
         return output
 
 
@@ -81,20 +92,7 @@ class AblationLayerVit(AblationLayer):
     def __call__(self, x):
         output = self.activations
         output = output.transpose(1, 2)
-        for i in range(output.size(0)):
-
-            # Commonly the minimum activation will be 0,
-            # And then it makes sense to zero it out.
-            # However depending on the architecture,
-            # If the values can be negative, we use very negative values
-            # to perform the ablation, deviating from the paper.
-            if torch.min(output) == 0:
-                output[i, self.indices[i], :] = 0
-            else:
-                ABLATION_VALUE = 1e7
-                output[i, self.indices[i], :] = torch.min(
-                    output) - ABLATION_VALUE
-
+        self.ablate(output)
         output = output.transpose(2, 1)
 
         return output
@@ -124,8 +122,12 @@ class AblationLayerFasterRCNN(AblationLayer):
         result = self.activations
         layers = {0: '0', 1: '1', 2: '2', 3: '3', 4: 'pool'}
         num_channels_to_ablate = result['pool'].size(0)
-        for i in range(num_channels_to_ablate):
-            pyramid_layer = int(self.indices[i]/256)
-            index_in_pyramid_layer = int(self.indices[i] % 256)
-            result[layers[pyramid_layer]][i, index_in_pyramid_layer, :, :] = -1000
+        indices = torch.as_tensor(np.asarray(self.indices[:num_channels_to_ablate]), dtype=torch.long)
+        rows = torch.arange(num_channels_to_ablate)
+        pyramid_layers = indices // 256
+        # One indexing operation per pyramid level instead of one per channel
+        for pyramid_layer in pyramid_layers.unique().tolist():
+            mask = pyramid_layers == pyramid_layer
+            activations = result[layers[pyramid_layer]]
+            activations[rows[mask].to(activations.device), (indices[mask] % 256).to(activations.device)] = -1000
         return result
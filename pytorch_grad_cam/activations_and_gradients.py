@@ -1,12 +1,29 @@
+import torch
+
+
 class ActivationsAndGradients:
     """ Class for extracting activations and
-    registering gradients from targetted intermediate layers """
+    registering gradients from targetted intermediate layers.
 
-    def __init__(self, model, target_layers, reshape_transform):
+    Every target layer has its own slot in self.activations and self.gradients
+    (None until the layer ran). With keep_on_device=True the tensors stay on the
+    model's device, otherwise they are copied to the cpu.
+    self.graph_outputs keeps the layer outputs for computing their gradients with
+    torch.autograd.grad, as gradient edges where torch supports them, so that an
+    in-place operation after the layer (like ReLU(inplace=True)) doesn't change which
+    gradient is computed. They reference the autograd graph of the batch, the CAM
+    drops them with release_graph() once the gradients are computed. The tensor hooks don't store gradients while
+    store_gradients is False. """
+
+    def __init__(self, model, target_layers, reshape_transform, keep_on_device=False):
         self.model = model
-        self.gradients = []
-        self.activations = []
         self.reshape_transform = reshape_transform
+        self.keep_on_device = keep_on_device
+        self.layer_indices = {target_layer: index for index, target_layer in enumerate(target_layers)}
+        self.gradients = [None] * len(target_layers)
+        self.activations = [None] * len(target_layers)
+        self.graph_outputs = [None] * len(target_layers)
+        self.store_gradients = True
         self.handles = []
         for target_layer in target_layers:
             self.handles.append(
@@ -16,29 +33,48 @@ class ActivationsAndGradients:
             self.handles.append(
                 target_layer.register_forward_hook(self.save_gradient))
 
+    def store(self, tensor):
+        tensor = tensor.detach()
+        if not self.keep_on_device:
+            tensor = tensor.cpu()
+        return tensor
+
     def save_activation(self, module, input, output):
         activation = output
-        
+
         if self.reshape_transform is not None:
             activation = self.reshape_transform(activation)
-        self.activations.append(activation.cpu().detach())
+        self.activations[self.layer_indices[module]] = self.store(activation)
 
     def save_gradient(self, module, input, output):
         if not hasattr(output, "requires_grad") or not output.requires_grad:
             # You can only register hooks on tensor requires grad.
             return
 
-        # Gradients are computed in reverse order
+        index = self.layer_indices[module]
+        if hasattr(torch.autograd.graph, "get_gradient_edge"):
+            self.graph_outputs[index] = torch.autograd.graph.get_gradient_edge(output)
+        else:
+            self.graph_outputs[index] = output
+
+        # Gradients are computed in reverse order,
+        # the slot index keeps them aligned with the target layers.
         def _store_grad(grad):
+            if not self.store_gradients:
+                return
             if self.reshape_transform is not None:
                 grad = self.reshape_transform(grad)
-            self.gradients = [grad.cpu().detach()] + self.gradients
+            self.gradients[index] = self.store(grad)
 
         output.register_hook(_store_grad)
 
+    def release_graph(self):
+        self.graph_outputs = [None] * len(self.graph_outputs)
+
     def __call__(self, x):
-        self.gradients = []
-        self.activations = []
+        self.gradients = [None] * len(self.gradients)
+        self.activations = [None] * len(self.activations)
+        self.release_graph()
         return self.model(x)
 
     def release(self):
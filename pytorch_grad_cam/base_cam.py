@@ -6,6 +6,14 @@ from pytorch_grad_cam.activations_and_gradients import ActivationsAndGradients
 from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection
 from pytorch_grad_cam.utils.image import scale_cam_image
 from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
+from pytorch_grad_cam.utils.profiling import NullProfiler
+
+
+def is_vmap_unsupported(error: RuntimeError) -> bool:
+    """ The errors of operations that can't run with is_grads_batched=True, like
+        'Batching rule not implemented for aten::...' or autograd.Functions without vmap support. """
+    message = str(error)
+    return 'batching rule' in message.lower() or 'vmap' in message
 
 
 class BaseCAM:
@@ -15,7 +23,10 @@ class BaseCAM:
                  use_cuda: bool = False,
                  reshape_transform: Callable = None,
                  compute_input_gradient: bool = False,
-                 uses_gradients: bool = True) -> None:
+                 uses_gradients: bool = True,
+                 keep_on_device: bool = False,
+                 projection_method: str = 'svd',
+                 projection_tol: float = None) -> None:
         self.model = model.eval()
         self.target_layers = target_layers
         self.cuda = use_cuda
@@ -25,7 +36,33 @@ class BaseCAM:
         self.compute_input_gradient = compute_input_gradient
         self.uses_gradients = uses_gradients
         self.activations_and_grads = ActivationsAndGradients(
-            self.model, target_layers, reshape_transform)
+            self.model, target_layers, reshape_transform, keep_on_device)
+        # Test time augmentations averaged with aug_smooth=True,
+        # can be replaced after construction: cam.tta_transforms = tta.Compose([...])
+        self.tta_transforms = tta.Compose(
+            [
+                tta.HorizontalFlip(),
+                tta.Multiply(factors=[0.9, 1, 1.1]),
+            ]
+        )
+        # Opt-in timing of the phases of a call: cam.profiler = PhaseProfiler()
+        self.profiler = NullProfiler()
+        # Solver of the first principal component for eigen_smooth and the Eigen CAMs,
+        # see get_2d_projection. Also settable after construction: cam.projection_method = 'power'
+        self.projection_method = projection_method
+        self.projection_tol = projection_tol
+
+    """ Keep the activations and gradients on the model's device and compute
+        the CAM in torch, only the final map is copied to the cpu.
+        Can also be switched on after construction: cam.keep_on_device = True """
+
+    @property
+    def keep_on_device(self) -> bool:
+        return self.activations_and_grads.keep_on_device
+
+    @keep_on_device.setter
+    def keep_on_device(self, value: bool) -> None:
+        self.activations_and_grads.keep_on_device = value
 
     """ Get a vector of weights for every channel in the target layer.
         Methods that return weights channels,
@@ -39,6 +76,14 @@ class BaseCAM:
                         grads: torch.Tensor) -> np.ndarray:
         raise Exception("Not Implemented")
 
+    def eigen_projection(self, activations: torch.Tensor) -> np.ndarray:
+        """ Projection of the (B, C, H, W) activations on their first principal component,
+            with the configured projection_method and projection_tol. """
+        with self.profiler.phase('eigen_projection'):
+            return get_2d_projection(activations,
+                                     method=self.projection_method,
+                                     tol=self.projection_tol)
+
     def get_cam_image(self,
                       input_tensor: torch.Tensor,
                       target_layer: torch.nn.Module,
@@ -47,14 +92,17 @@ class BaseCAM:
                       grads: torch.Tensor,
                       eigen_smooth: bool = False) -> np.ndarray:
 
-        weights = self.get_cam_weights(input_tensor,
-                                       target_layer,
-                                       targets,
-                                       activations,
-                                       grads)
+        with self.profiler.phase('get_cam_weights'):
+            weights = self.get_cam_weights(input_tensor,
+                                           target_layer,
+                                           targets,
+                                           activations,
+                                           grads)
+        if torch.is_tensor(activations) and not torch.is_tensor(weights):
+            weights = torch.from_numpy(np.float32(weights)).to(activations.device)
         weighted_activations = weights[:, :, None, None] * activations
         if eigen_smooth:
-            cam = get_2d_projection(weighted_activations)
+            cam = self.eigen_projection(weighted_activations)
         else:
             cam = weighted_activations.sum(axis=1)
         return cam
@@ -64,6 +112,9 @@ class BaseCAM:
                 targets: List[torch.nn.Module],
                 eigen_smooth: bool = False) -> np.ndarray:
 
+        if targets is not None and len(targets) > 0 and isinstance(targets[0], (list, tuple)):
+            return self.forward_multiple_targets(input_tensor, targets, eigen_smooth)
+
         if self.cuda:
             input_tensor = input_tensor.cuda()
 
@@ -71,15 +122,27 @@ class BaseCAM:
             input_tensor = torch.autograd.Variable(input_tensor,
                                                    requires_grad=True)
 
-        outputs = self.activations_and_grads(input_tensor)
-        if targets is None:
-            target_categories = np.argmax(outputs.cpu().data.numpy(), axis=-1)
-            targets = [ClassifierOutputTarget(category) for category in target_categories]
+        with self.profiler.phase('forward'):
+            outputs = self.activations_and_grads(input_tensor)
+            # The logits for callers, without the autograd graph of the batch
+            self.outputs = outputs.detach()
+
+        try:
+            with self.profiler.phase('targets'):
+                if targets is None:
+                    target_categories = np.argmax(outputs.cpu().data.numpy(), axis=-1)
+                    targets = [ClassifierOutputTarget(category) for category in target_categories]
 
-        if self.uses_gradients:
-            self.model.zero_grad()
-            loss = sum([target(output) for target, output in zip(targets, outputs)])
-            loss.backward(retain_graph=True)
+                if self.uses_gradients:
+                    self.model.zero_grad()
+                    loss = sum([target(output) for target, output in zip(targets, outputs)])
+
+            if self.uses_gradients:
+                with self.profiler.phase('backward'):
+                    loss.backward(retain_graph=True)
+        finally:
+            # Don't keep the graph (and its saved tensors) alive until the next call
+            self.activations_and_grads.release_graph()
 
         # In most of the saliency attribution papers, the saliency is
         # computed with a single target layer.
@@ -93,7 +156,100 @@ class BaseCAM:
         cam_per_layer = self.compute_cam_per_layer(input_tensor,
                                                    targets,
                                                    eigen_smooth)
-        return self.aggregate_multi_layers(cam_per_layer)
+        with self.profiler.phase('aggregate_multi_layers'):
+            return self.aggregate_multi_layers(cam_per_layer)
+
+    """ Several targets for every image, for example the maps of both classes:
+            cam(input_tensor, targets=[[ClassifierOutputTarget(0), ClassifierOutputTarget(1)]] * batch_size)
+        returns B x T x H x W maps. The forward pass is shared, and the gradients of
+        all the targets are computed with one batched autograd call. The maps are then
+        computed as for a batch of B * T images. """
+
+    def forward_multiple_targets(self,
+                                 input_tensor: torch.Tensor,
+                                 targets: List[List[torch.nn.Module]],
+                                 eigen_smooth: bool = False) -> np.ndarray:
+        number_of_targets = len(targets[0])
+        if any(len(image_targets) != number_of_targets for image_targets in targets):
+            raise ValueError("Every image needs the same number of targets")
+
+        if self.cuda:
+            input_tensor = input_tensor.cuda()
+
+        if self.compute_input_gradient:
+            input_tensor = torch.autograd.Variable(input_tensor,
+                                                   requires_grad=True)
+
+        activations_and_grads = self.activations_and_grads
+        with self.profiler.phase('forward'):
+            outputs = activations_and_grads(input_tensor)
+            # The logits for callers, without the autograd graph of the batch
+            self.outputs = outputs.detach()
+
+        def expand(tensor):
+            # Image b is repeated for each of its targets: b0, b0, b1, b1, ...
+            return tensor.repeat_interleave(number_of_targets, dim=0)
+
+        expanded_input = expand(input_tensor.detach())
+        try:
+            if self.uses_gradients:
+                with self.profiler.phase('targets'):
+                    scores = torch.stack([torch.stack([target(output) for target in image_targets])
+                                          for image_targets, output in zip(targets, outputs)])
+                indices = [i for i, output in enumerate(activations_and_grads.graph_outputs) if output is not None]
+                inputs = [activations_and_grads.graph_outputs[i] for i in indices]
+                if self.compute_input_gradient:
+                    inputs.append(input_tensor)
+                with self.profiler.phase('backward'):
+                    grads = self.get_target_gradients(scores, inputs)
+
+                gradients = [None] * len(activations_and_grads.gradients)
+                for i, grad in zip(indices, grads):
+                    # (T, B, ...) -> (B * T, ...)
+                    grad = grad.transpose(0, 1).reshape(-1, *grad.shape[2:])
+                    if self.reshape_transform is not None:
+                        grad = self.reshape_transform(grad)
+                    gradients[i] = activations_and_grads.store(grad)
+                activations_and_grads.gradients = gradients
+                if self.compute_input_gradient:
+                    expanded_input.grad = grads[-1].transpose(0, 1).reshape(expanded_input.shape)
+        finally:
+            # Don't keep the graph (and its saved tensors) alive until the next call
+            activations_and_grads.release_graph()
+
+        activations_and_grads.activations = [a if a is None else expand(a)
+                                             for a in activations_and_grads.activations]
+        flat_targets = [target for image_targets in targets for target in image_targets]
+        cam_per_layer = self.compute_cam_per_layer(expanded_input,
+                                                   flat_targets,
+                                                   eigen_smooth)
+        with self.profiler.phase('aggregate_multi_layers'):
+            cam = self.aggregate_multi_layers(cam_per_layer)
+        return cam.reshape(len(targets), number_of_targets, *cam.shape[1:])
+
+    def get_target_gradients(self,
+                             scores: torch.Tensor,
+                             inputs: List[torch.Tensor]) -> List[torch.Tensor]:
+        """ Gradients of every column of the (B, T) scores, (T, B, ...) for every input. """
+        number_of_targets = scores.size(1)
+        grad_outputs = torch.eye(number_of_targets, dtype=scores.dtype, device=scores.device)
+        grad_outputs = grad_outputs[:, None, :].expand(-1, scores.size(0), -1).contiguous()
+        # The tensor hooks would get the batched gradients
+        self.activations_and_grads.store_gradients = False
+        try:
+            try:
+                return list(torch.autograd.grad(scores, inputs, grad_outputs=grad_outputs,
+                                                retain_graph=True, is_grads_batched=True))
+            except RuntimeError as e:
+                # Only an operation without a vmap batching rule falls back to one
+                # backward pass per target, e.g. out of memory errors are raised
+                if not is_vmap_unsupported(e):
+                    raise
+                per_target = [torch.autograd.grad(scores[:, t].sum(), inputs, retain_graph=True)
+                              for t in range(number_of_targets)]
+                return [torch.stack(grads) for grads in zip(*per_target)]
+        finally:
+            self.activations_and_grads.store_gradients = True
 
     def get_target_width_height(self,
                                 input_tensor: torch.Tensor) -> Tuple[int, int]:
@@ -105,10 +261,13 @@ class BaseCAM:
             input_tensor: torch.Tensor,
             targets: List[torch.nn.Module],
             eigen_smooth: bool) -> np.ndarray:
-        activations_list = [a.cpu().data.numpy()
-                            for a in self.activations_and_grads.activations]
-        grads_list = [g.cpu().data.numpy()
-                      for g in self.activations_and_grads.gradients]
+        activations_list = self.activations_and_grads.activations
+        grads_list = self.activations_and_grads.gradients
+        if not self.keep_on_device:
+            activations_list = [a if a is None else a.cpu().data.numpy()
+                                for a in activations_list]
+            grads_list = [g if g is None else g.cpu().data.numpy()
+                          for g in grads_list]
         target_size = self.get_target_width_height(input_tensor)
 
         cam_per_target_layer = []
@@ -122,19 +281,26 @@ class BaseCAM:
             if i < len(grads_list):
                 layer_grads = grads_list[i]
 
-            cam = self.get_cam_image(input_tensor,
-                                     target_layer,
-                                     targets,
-                                     layer_activations,
-                                     layer_grads,
-                                     eigen_smooth)
-            cam = np.maximum(cam, 0)
-            scaled = scale_cam_image(cam, target_size)
+            with self.profiler.phase('get_cam_image'):
+                cam = self.get_cam_image(input_tensor,
+                                         target_layer,
+                                         targets,
+                                         layer_activations,
+                                         layer_grads,
+                                         eigen_smooth)
+            cam = cam.clip(min=0)
+            with self.profiler.phase('scale_cam_image'):
+                scaled = scale_cam_image(cam, target_size)
             cam_per_target_layer.append(scaled[:, None, :])
 
         return cam_per_target_layer
 
     def aggregate_multi_layers(self, cam_per_target_layer: np.ndarray) -> np.ndarray:
+        if torch.is_tensor(cam_per_target_layer[0]):
+            cam_per_target_layer = torch.cat(cam_per_target_layer, dim=1)
+            result = cam_per_target_layer.clip(min=0).mean(dim=1)
+            # The only copy to the host
+            return scale_cam_image(result).cpu().numpy()
         cam_per_target_layer = np.concatenate(cam_per_target_layer, axis=1)
         cam_per_target_layer = np.maximum(cam_per_target_layer, 0)
         result = np.mean(cam_per_target_layer, axis=1)
@@ -144,31 +310,30 @@ class BaseCAM:
                                        input_tensor: torch.Tensor,
                                        targets: List[torch.nn.Module],
                                        eigen_smooth: bool = False) -> np.ndarray:
-        transforms = tta.Compose(
-            [
-                tta.HorizontalFlip(),
-                tta.Multiply(factors=[0.9, 1, 1.1]),
-            ]
-        )
-        cams = []
-        for transform in transforms:
-            augmented_tensor = transform.augment_image(input_tensor)
-            cam = self.forward(augmented_tensor,
-                               targets,
-                               eigen_smooth)
-
-            # The ttach library expects a tensor of size BxCxHxW
-            cam = cam[:, None, :, :]
-            cam = torch.from_numpy(cam)
-            cam = transform.deaugment_mask(cam)
-
-            # Back to numpy float32, HxW
-            cam = cam.numpy()
-            cam = cam[:, 0, :, :]
-            cams.append(cam)
+        """ All the augmented copies of the batch go through the model as one batch,
+            with a single forward and backward pass. The transforms in
+            self.tta_transforms must keep the size of the image. """
+        transforms = list(self.tta_transforms)
+        augmented_tensor = torch.cat([transform.augment_image(input_tensor)
+                                      for transform in transforms])
+        if targets is not None:
+            targets = list(targets) * len(transforms)
+        cams = self.forward(augmented_tensor,
+                            targets,
+                            eigen_smooth)
 
-        cam = np.mean(np.float32(cams), axis=0)
-        return cam
+        # The ttach library expects a tensor of size BxCxHxW,
+        # the maps of several targets per image are already BxTxHxW
+        multiple_targets = cams.ndim == 4
+        cams = torch.from_numpy(cams if multiple_targets else cams[:, None, :, :])
+        cams = [transform.deaugment_mask(cam)
+                for transform, cam in zip(transforms, cams.split(input_tensor.size(0)))]
+
+        # Back to numpy float32, HxW
+        cam = torch.stack(cams).mean(dim=0)
+        if not multiple_targets:
+            cam = cam[:, 0, :, :]
+        return cam.numpy()
 
     def __call__(self,
                  input_tensor: torch.Tensor,
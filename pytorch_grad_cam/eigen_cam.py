@@ -1,5 +1,4 @@
 from pytorch_grad_cam.base_cam import BaseCAM
-from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection
 
 # https://arxiv.org/abs/2008.00299
 
@@ -20,4 +19,4 @@ class EigenCAM(BaseCAM):
                       activations,
                       grads,
                       eigen_smooth):
-        return get_2d_projection(activations)
+        return self.eigen_projection(activations)
@@ -1,5 +1,4 @@
 from pytorch_grad_cam.base_cam import BaseCAM
-from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection
 
 # Like Eigen CAM: https://arxiv.org/abs/2008.00299
 # But multiply the activations x gradients
@@ -18,4 +17,4 @@ class EigenGradCAM(BaseCAM):
                       activations,
                       grads,
                       eigen_smooth):
-        return get_2d_projection(grads * activations)
+        return self.eigen_projection(grads * activations)
@@ -1,9 +1,7 @@
-import numpy as np
 import torch
 from pytorch_grad_cam.base_cam import BaseCAM
 from pytorch_grad_cam.utils.find_layers import find_layer_predicate_recursive
-from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection
-from pytorch_grad_cam.utils.image import scale_accross_batch_and_channels, scale_cam_image
+from pytorch_grad_cam.utils.image import scale_accross_batch_and_channels, scale_cam_image, resize_cam_image
 
 # https://arxiv.org/abs/1905.00780
 
@@ -29,9 +27,10 @@ class FullGrad(BaseCAM):
             target_layers,
             use_cuda,
             reshape_transform,
-            compute_input_gradient=True)
-        self.bias_data = [self.get_bias_data(
-            layer).cpu().numpy() for layer in target_layers]
+            compute_input_gradient=True,
+            keep_on_device=True)
+        # On the model's device, like the gradients
+        self.bias_data = [self.get_bias_data(layer) for layer in target_layers]
 
     def get_bias_data(self, layer):
         # Borrowed from official paper impl:
@@ -48,48 +47,61 @@ class FullGrad(BaseCAM):
             input_tensor,
             target_category,
             eigen_smooth):
-        input_grad = input_tensor.grad.data.cpu().numpy()
-        grads_list = [g.cpu().data.numpy() for g in
-                      self.activations_and_grads.gradients]
-        cam_per_target_layer = []
+        input_grad = input_tensor.grad
+        grads_list = self.activations_and_grads.gradients
         target_size = self.get_target_width_height(input_tensor)
 
-        gradient_multiplied_input = input_grad * input_tensor.data.cpu().numpy()
-        gradient_multiplied_input = np.abs(gradient_multiplied_input)
-        gradient_multiplied_input = scale_accross_batch_and_channels(
-            gradient_multiplied_input,
-            target_size)
-        cam_per_target_layer.append(gradient_multiplied_input)
+        gradient_multiplied_input = input_grad * input_tensor.detach().to(input_grad.device)
+        gradient_multiplied_input = gradient_multiplied_input.abs()
+        with self.profiler.phase('scale_cam_image'):
+            gradient_multiplied_input = scale_accross_batch_and_channels(
+                gradient_multiplied_input,
+                target_size)
+        # The maps of all the layers are only kept for the eigen projection,
+        # otherwise they are summed up as they are computed.
+        cam_per_target_layer = [gradient_multiplied_input]
+        cam_sum = gradient_multiplied_input.sum(dim=1)
 
         # Loop over the saliency image from every layer
         assert(len(self.bias_data) == len(grads_list))
         for bias, grads in zip(self.bias_data, grads_list):
-            bias = bias[None, :, None, None]
+            if grads is None:
+                continue
+            bias = bias.to(grads.device)[None, :, None, None]
             # In the paper they take the absolute value,
             # but possibily taking only the positive gradients will work
             # better.
-            bias_grad = np.abs(bias * grads)
-            result = scale_accross_batch_and_channels(
-                bias_grad, target_size)
-            result = np.sum(result, axis=1)
-            cam_per_target_layer.append(result[:, None, :])
-        cam_per_target_layer = np.concatenate(cam_per_target_layer, axis=1)
+            bias_grad = (bias * grads).abs()
+            with self.profiler.phase('scale_cam_image'):
+                # Bilinear resizing is linear, so the normalized channels can be
+                # summed before resizing, instead of resizing every channel.
+                normalized = scale_cam_image(bias_grad.reshape(-1, *bias_grad.shape[2:]))
+                result = normalized.reshape(bias_grad.shape).sum(dim=1)
+                result = resize_cam_image(result, target_size)
+            if eigen_smooth:
+                cam_per_target_layer.append(result[:, None, :])
+            cam_sum = cam_sum + result
+
         if eigen_smooth:
+            cam_per_target_layer = torch.cat(cam_per_target_layer, dim=1)
             # Resize to a smaller image, since this method typically has a very large number of channels,
             # and then consumes a lot of memory
-            cam_per_target_layer = scale_accross_batch_and_channels(
-                cam_per_target_layer, (target_size[0] // 8, target_size[1] // 8))
-            cam_per_target_layer = get_2d_projection(cam_per_target_layer)
+            with self.profiler.phase('scale_cam_image'):
+                cam_per_target_layer = scale_accross_batch_and_channels(
+                    cam_per_target_layer, (target_size[0] // 8, target_size[1] // 8))
+            cam_per_target_layer = self.eigen_projection(cam_per_target_layer)
             cam_per_target_layer = cam_per_target_layer[:, None, :, :]
-            cam_per_target_layer = scale_accross_batch_and_channels(
-                cam_per_target_layer,
-                target_size)
+            with self.profiler.phase('scale_cam_image'):
+                cam_per_target_layer = scale_accross_batch_and_channels(
+                    cam_per_target_layer,
+                    target_size)
         else:
-            cam_per_target_layer = np.sum(
-                cam_per_target_layer, axis=1)[:, None, :]
+            cam_per_target_layer = cam_sum[:, None, :]
 
         return cam_per_target_layer
 
     def aggregate_multi_layers(self, cam_per_target_layer):
-        result = np.sum(cam_per_target_layer, axis=1)
-        return scale_cam_image(result)
+        result = cam_per_target_layer.sum(dim=1)
+        # The only copy to the host
+        return scale_cam_image(result).cpu().numpy()
+
@@ -1,6 +1,5 @@
 import numpy as np
 from pytorch_grad_cam.base_cam import BaseCAM
-from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection
 
 class GradCAMElementWise(BaseCAM):
     def __init__(self, model, target_layers, use_cuda=False,
@@ -20,11 +19,11 @@ class GradCAMElementWise(BaseCAM):
                       activations,
                       grads,
                       eigen_smooth):
-        elementwise_activations = np.maximum(grads * activations, 0)
+        elementwise_activations = (grads * activations).clip(min=0)
 
 
         if eigen_smooth:
-            cam = get_2d_projection(elementwise_activations)
+            cam = self.eigen_projection(elementwise_activations)
         else:
             cam = elementwise_activations.sum(axis=1)
         return cam
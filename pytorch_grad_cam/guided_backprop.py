@@ -1,7 +1,6 @@
 import numpy as np
 import torch
 from torch.autograd import Function
-from pytorch_grad_cam.utils.find_layers import replace_all_layer_type_recursive
 
 
 class GuidedBackpropReLU(Function):
@@ -44,6 +43,12 @@ class GuidedBackpropReLUasModule(torch.nn.Module):
 
 
 class GuidedBackpropReLUModel:
+    """ Guided backpropagation through every torch.nn.ReLU of the model.
+
+    The ReLU modules get forward hooks that apply GuidedBackpropReLU to their
+    output, only for the duration of a guided pass. The model is never rewritten,
+    and nothing stays registered on it in between (e.g. for a CAM on the same model). """
+
     def __init__(self, model, use_cuda):
         self.model = model
         self.model.eval()
@@ -51,50 +56,45 @@ class GuidedBackpropReLUModel:
         if self.cuda:
             self.model = self.model.cuda()
 
+    @staticmethod
+    def guided_relu(module, input, output):
+        # The forward is the identity on the ReLU output, the backward
+        # only lets positive gradients through to positive activations
+        return GuidedBackpropReLU.apply(output)
+
     def forward(self, input_img):
         return self.model(input_img)
 
-    def recursive_replace_relu_with_guidedrelu(self, module_top):
-
-        for idx, module in module_top._modules.items():
-            self.recursive_replace_relu_with_guidedrelu(module)
-            if module.__class__.__name__ == 'ReLU':
-                module_top._modules[idx] = GuidedBackpropReLU.apply
-        print("b")
-
-    def recursive_replace_guidedrelu_with_relu(self, module_top):
-        try:
-            for idx, module in module_top._modules.items():
-                self.recursive_replace_guidedrelu_with_relu(module)
-                if module == GuidedBackpropReLU.apply:
-                    module_top._modules[idx] = torch.nn.ReLU()
-        except BaseException:
-            pass
-
-    def __call__(self, input_img, target_category=None):
-        replace_all_layer_type_recursive(self.model,
-                                         torch.nn.ReLU,
-                                         GuidedBackpropReLUasModule())
-
+    def batch(self, input_img, target_categories=None):
+        """ Guided backpropagation for a whole batch with one forward and one backward pass.
+            target_categories: None for the predicted class of every image,
+            a single category for all images, or a list with one category per image.
+            Returns a B x H x W x C numpy array. """
         if self.cuda:
             input_img = input_img.cuda()
+        input_img = input_img.detach().requires_grad_(True)
 
-        input_img = input_img.requires_grad_(True)
-
-        output = self.forward(input_img)
-
-        if target_category is None:
-            target_category = np.argmax(output.cpu().data.numpy())
-
-        loss = output[0, target_category]
-        loss.backward(retain_graph=True)
-
-        output = input_img.grad.cpu().data.numpy()
-        output = output[0, :, :, :]
-        output = output.transpose((1, 2, 0))
-
-        replace_all_layer_type_recursive(self.model,
-                                         GuidedBackpropReLUasModule,
-                                         torch.nn.ReLU())
+        handles = [module.register_forward_hook(self.guided_relu)
+                   for module in self.model.modules()
+                   if isinstance(module, torch.nn.ReLU)]
+        try:
+            output = self.forward(input_img)
+            if target_categories is None:
+                target_categories = np.argmax(output.cpu().data.numpy(), axis=-1)
+            elif np.ndim(target_categories) == 0:
+                target_categories = [target_categories] * output.size(0)
+            target_categories = torch.as_tensor(np.asarray(target_categories), device=output.device)
+
+            # The images don't interact in eval mode, so the gradient of the sum
+            # is the gradient of every image's own score
+            loss = output.gather(1, target_categories.long()[:, None]).sum()
+            grads, = torch.autograd.grad(loss, input_img)
+        finally:
+            for handle in handles:
+                handle.remove()
+
+        return grads.cpu().data.numpy().transpose((0, 2, 3, 1))
 
-        return output
+    def __call__(self, input_img, target_category=None):
+        """ Guided backpropagation of the first image of the batch, H x W x C. """
+        return self.batch(input_img[:1], target_category)[0]
@@ -0,0 +1,84 @@
+import numpy as np
+import torch
+from pytorch_grad_cam.grad_cam import GradCAM
+from pytorch_grad_cam.guided_backprop import GuidedBackpropReLU
+
+# https://arxiv.org/abs/1610.02391
+
+
+class GuidedGradCAM(GradCAM):
+    """ Guided Grad-CAM: the Grad-CAM map times the guided backpropagation
+    gradient of the input, from the same forward and backward pass.
+
+    The ReLUs that run before the (first) target layer backpropagate like in
+    guided backpropagation, the ones after it stay plain ReLUs, so that the
+    gradients of the target layer are the usual Grad-CAM gradients. For models
+    without ReLUs after the target layer, like ResNets with layer4[-1], this is
+    the same as running GuidedBackpropReLUModel and GradCAM separately.
+
+    Returns B x H x W x C maps (B x T x H x W x C for several targets per image),
+    the Grad-CAM maps and the guided gradients of the last call are kept in
+    self.cam and self.guided_gradients. """
+
+    def __init__(self, model, target_layers, use_cuda=False,
+                 reshape_transform=None):
+        super(
+            GuidedGradCAM,
+            self).__init__(
+            model,
+            target_layers,
+            use_cuda,
+            reshape_transform)
+        self.compute_input_gradient = True
+        self.before_target_layer = False
+
+    def target_layer_passed(self, module, input, output):
+        self.before_target_layer = False
+
+    def guided_relu(self, module, input, output):
+        if self.before_target_layer:
+            return GuidedBackpropReLU.apply(output)
+
+    def compute_cam_per_layer(self,
+                              input_tensor,
+                              targets,
+                              eigen_smooth):
+        # The guided gradient of the input, from the backward pass of the cam
+        self.input_gradient = input_tensor.grad
+        return super(GuidedGradCAM, self).compute_cam_per_layer(input_tensor,
+                                                                targets,
+                                                                eigen_smooth)
+
+    def forward(self,
+                input_tensor,
+                targets,
+                eigen_smooth=False):
+        # Only registered during the call, so that the model doesn't keep this instance alive.
+        # The target layer hooks first, so that a ReLU target layer stays plain.
+        handles = [target_layer.register_forward_hook(self.target_layer_passed)
+                   for target_layer in self.target_layers]
+        handles += [module.register_forward_hook(self.guided_relu)
+                    for module in self.model.modules()
+                    if isinstance(module, torch.nn.ReLU)]
+        self.before_target_layer = True
+        try:
+            cam = super(GuidedGradCAM, self).forward(input_tensor,
+                                                     targets,
+                                                     eigen_smooth)
+        finally:
+            self.before_target_layer = False
+            for handle in handles:
+                handle.remove()
+
+        # B x C x H x W -> B (x T) x H x W x C, aligned with the maps
+        guided_gradients = self.input_gradient.cpu().data.numpy().transpose((0, 2, 3, 1))
+        self.guided_gradients = guided_gradients.reshape(*cam.shape, -1)
+        self.cam = cam
+        return np.float32(cam[..., None] * self.guided_gradients)
+
+    def forward_augmentation_smoothing(self,
+                                       input_tensor,
+                                       targets,
+                                       eigen_smooth=False):
+        raise ValueError("aug_smooth is not supported by GuidedGradCAM, "
+                         "the guided gradients can't be de-augmented like the maps")
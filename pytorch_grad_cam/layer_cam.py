@@ -1,6 +1,5 @@
 import numpy as np
 from pytorch_grad_cam.base_cam import BaseCAM
-from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection
 
 # https://ieeexplore.ieee.org/document/9462463
 
@@ -27,10 +26,10 @@ class LayerCAM(BaseCAM):
                       activations,
                       grads,
                       eigen_smooth):
-        spatial_weighted_activations = np.maximum(grads, 0) * activations
+        spatial_weighted_activations = grads.clip(min=0) * activations
 
         if eigen_smooth:
-            cam = get_2d_projection(spatial_weighted_activations)
+            cam = self.eigen_projection(spatial_weighted_activations)
         else:
             cam = spatial_weighted_activations.sum(axis=1)
         return cam
@@ -1,6 +1,8 @@
+import math
 import torch
-import tqdm
 from pytorch_grad_cam.base_cam import BaseCAM
+from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
+from pytorch_grad_cam.utils.parallel import parallel_map
 
 
 class ScoreCAM(BaseCAM):
@@ -9,55 +11,111 @@ class ScoreCAM(BaseCAM):
             model,
             target_layers,
             use_cuda=False,
-            reshape_transform=None):
+            reshape_transform=None,
+            ratio_channels_to_score=1.0,
+            top_k_channels=None,
+            channel_ranking='energy',
+            num_workers=1):
+        # Without pruning every channel is scored, and the ranking (and its backward pass) isn't needed
+        prunes_channels = top_k_channels is not None or ratio_channels_to_score < 1.0
         super(ScoreCAM, self).__init__(model,
                                        target_layers,
                                        use_cuda,
                                        reshape_transform=reshape_transform,
-                                       uses_gradients=False)
+                                       uses_gradients=channel_ranking == 'gradient' and prunes_channels)
+        # After BaseCAM.__init__, so that __del__ can release the hooks
+        if channel_ranking not in ('energy', 'gradient'):
+            raise ValueError(f"Unknown channel_ranking {channel_ranking}, "
+                             "expected 'energy' or 'gradient'")
+        if top_k_channels is not None and top_k_channels < 1:
+            raise ValueError(f"top_k_channels must be at least 1, got {top_k_channels}")
+        self.ratio_channels_to_score = ratio_channels_to_score
+        self.top_k_channels = top_k_channels
+        self.channel_ranking = channel_ranking
+        self.num_workers = num_workers
 
         if len(target_layers) > 0:
             print("Warning: You are using ScoreCAM with target layers, "
                   "however ScoreCAM will ignore them.")
 
+    """ Every scored channel costs a forward pass. With top_k_channels or
+        ratio_channels_to_score < 1.0 only the highest ranked channels are scored,
+        the others get a weight of 0. Channels are ranked by
+            'energy': the sum of the squared activations.
+            'gradient': |sum(activations * gradients)|, the first order estimate of
+                        the score change when the channel is removed. Costs one backward pass. """
+
+    def channels_to_score(self, activations, grads):
+        number_of_channels = activations.size(1)
+        if self.top_k_channels is not None:
+            k = max(1, min(self.top_k_channels, number_of_channels))
+        else:
+            k = max(1, int(math.ceil(number_of_channels * self.ratio_channels_to_score)))
+        if k >= number_of_channels:
+            return torch.arange(number_of_channels, device=activations.device).repeat(activations.size(0), 1)
+
+        if self.channel_ranking == 'gradient':
+            ranking = (activations * grads.to(activations.device)).sum(dim=(2, 3)).abs()
+        else:
+            ranking = (activations ** 2).sum(dim=(2, 3))
+        return ranking.topk(k, dim=1).indices.sort(dim=1).values
+
     def get_cam_weights(self,
                         input_tensor,
                         target_layer,
                         targets,
                         activations,
                         grads):
+        """ The masked inputs are built one batch of channels at a time, so the
+            memory stays O(batch_size) instead of B x C x 3 x H x W.
+            With num_workers > 1 the channel batches are scored in parallel
+            by forked processes on the cpu, see utils/parallel.py. """
         with torch.no_grad():
             upsample = torch.nn.UpsamplingBilinear2d(
                 size=input_tensor.shape[-2:])
-            activation_tensor = torch.from_numpy(activations)
+            activation_tensor = torch.as_tensor(activations)
             if self.cuda:
                 activation_tensor = activation_tensor.cuda()
 
-            upsampled = upsample(activation_tensor)
-
-            maxs = upsampled.view(upsampled.size(0),
-                                  upsampled.size(1), -1).max(dim=-1)[0]
-            mins = upsampled.view(upsampled.size(0),
-                                  upsampled.size(1), -1).min(dim=-1)[0]
-
-            maxs, mins = maxs[:, :, None, None], mins[:, :, None, None]
-            upsampled = (upsampled - mins) / (maxs - mins)
-
-            input_tensors = input_tensor[:, None,
-                                         :, :] * upsampled[:, :, None, :, :]
-
             if hasattr(self, "batch_size"):
                 BATCH_SIZE = self.batch_size
             else:
                 BATCH_SIZE = 16
 
-            scores = []
-            for target, tensor in zip(targets, input_tensors):
-                for i in tqdm.tqdm(range(0, tensor.size(0), BATCH_SIZE)):
-                    batch = tensor[i: i + BATCH_SIZE, :]
-                    outputs = [target(o).cpu().item() for o in self.model(batch)]
-                    scores.extend(outputs)
-            scores = torch.Tensor(scores)
-            scores = scores.view(activations.shape[0], activations.shape[1])
-            weights = torch.nn.Softmax(dim=-1)(scores).numpy()
+            channels = self.channels_to_score(activation_tensor,
+                                              None if grads is None else torch.as_tensor(grads))
+
+            def score_batch(task):
+                index, i = task
+                with torch.no_grad():
+                    batch_channels = channels[index, i: i + BATCH_SIZE]
+                    upsampled = upsample(activation_tensor[index:index + 1, batch_channels])[0]
+                    maxs = upsampled.view(upsampled.size(0), -1).max(dim=-1)[0]
+                    mins = upsampled.view(upsampled.size(0), -1).min(dim=-1)[0]
+                    maxs, mins = maxs[:, None, None], mins[:, None, None]
+                    # Constant channels become an all zero mask instead of NaN
+                    upsampled = (upsampled - mins) / (maxs - mins + 1e-7)
+
+                    tensor = input_tensor[index]
+                    batch = tensor[None, :] * upsampled[:, None, :, :].to(tensor.device)
+                    return self.score_outputs(targets[index], self.model(batch))
+
+            tasks = [(index, i) for index in range(len(targets))
+                     for i in range(0, channels.size(1), BATCH_SIZE)]
+            batch_scores = parallel_map(score_batch, tasks, self.num_workers,
+                                        tensors=[activation_tensor, input_tensor],
+                                        profiler=self.profiler, name='score_cam_batch')
+
+            # Channels that aren't scored get a softmax weight of 0
+            scores = torch.full(activation_tensor.shape[:2], -float('inf'), device=activation_tensor.device)
+            for (index, i), batch_score in zip(tasks, batch_scores):
+                scores[index, channels[index, i: i + BATCH_SIZE]] = batch_score.to(scores)
+
+            weights = torch.nn.Softmax(dim=-1)(scores).cpu().numpy()
             return weights
+
+    def score_outputs(self, target, outputs):
+        """ Target scores of a whole batch of model outputs. """
+        if isinstance(target, ClassifierOutputTarget):
+            return target(outputs)
+        return torch.stack([torch.as_tensor(target(o)).reshape(()) for o in outputs])
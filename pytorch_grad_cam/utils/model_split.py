@@ -0,0 +1,67 @@
+import torch
+import torch.fx
+
+
+class _TargetLayerTracer(torch.fx.Tracer):
+    """ Keeps the target layer as a single call_module node, so the graph can be cut there. """
+
+    def __init__(self, target_layer):
+        super(_TargetLayerTracer, self).__init__()
+        self.target_layer = target_layer
+
+    def is_leaf_module(self, module, module_qualified_name):
+        return module is self.target_layer or super().is_leaf_module(module, module_qualified_name)
+
+
+def get_model_tail(model, target_layer):
+    """ Returns a module that computes the model output from the output of target_layer,
+        for example avgpool + flatten + fc for layer4[-1] of a ResNet.
+        It shares the parameters with the model.
+
+        Returns None if the model can't be split there: it can't be traced with torch.fx,
+        the target layer is called more than once, or anything else computed before
+        the target layer is used after it (a skip connection around the layer). """
+    names = [name for name, module in model.named_modules() if module is target_layer]
+    if len(names) != 1:
+        return None
+
+    # Hooks, like the ones of ActivationsAndGradients on other target layers,
+    # would be called with fx proxies. They stay registered on the modules
+    # and still run when the tail is called.
+    modules = list(model.modules())
+    hooks = [(module._forward_pre_hooks.copy(), module._forward_hooks.copy()) for module in modules]
+    for module in modules:
+        module._forward_pre_hooks.clear()
+        module._forward_hooks.clear()
+    try:
+        graph = _TargetLayerTracer(target_layer).trace(model)
+    except Exception:
+        # Data dependent control flow, like in detection models
+        return None
+    finally:
+        for module, (pre_hooks, forward_hooks) in zip(modules, hooks):
+            module._forward_pre_hooks.update(pre_hooks)
+            module._forward_hooks.update(forward_hooks)
+
+    target_nodes = [node for node in graph.nodes
+                    if node.op == 'call_module' and node.target == names[0]]
+    if len(target_nodes) != 1:
+        return None
+    target_node = target_nodes[0]
+
+    nodes = list(graph.nodes)
+    head = set(nodes[:nodes.index(target_node)])
+    tail = nodes[nodes.index(target_node) + 1:]
+
+    tail_graph = torch.fx.Graph()
+    environment = {target_node: tail_graph.placeholder('activations')}
+    for node in tail:
+        for input_node in node.all_input_nodes:
+            if input_node in head and input_node not in environment:
+                if input_node.op != 'get_attr':
+                    return None
+                # Parameters and buffers don't depend on the input, they can be copied
+                environment[input_node] = tail_graph.node_copy(input_node, lambda n: environment[n])
+        environment[node] = tail_graph.node_copy(node, lambda n: environment[n])
+
+    return torch.fx.GraphModule(model, tail_graph)
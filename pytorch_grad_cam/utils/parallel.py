@@ -0,0 +1,60 @@
+import multiprocessing
+import threading
+import warnings
+
+import torch
+
+from pytorch_grad_cam.utils.profiling import NullProfiler
+
+# The function the forked workers call. Forking copies it into the workers,
+# so closures over the model and the activations don't need to be pickled.
+_function = None
+_lock = threading.Lock()
+
+
+def _initialize_worker():
+    # Every worker gets one core, instead of every worker using all of them
+    torch.set_num_threads(1)
+
+
+def _call(argument):
+    return _function(argument)
+
+
+def can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def parallel_map(function, arguments, num_workers=1, tensors=(), profiler=None, name='batches'):
+    """ [function(argument) for argument in arguments], iterated through
+        profiler.iterate(name, ...), by default with a tqdm progress bar.
+
+        With num_workers > 1 the arguments are spread over a pool of forked processes,
+        and the results come back in order. The model weights and the tensors the
+        function uses are shared with the workers copy-on-write, they aren't modified.
+        Falls back to running in this process if fork isn't available (Windows),
+        if any of the tensors (e.g. the cached activations) is on the gpu, since CUDA
+        can't be used in a forked process, or if other threads are running (a Streamlit
+        app, a server or a writer thread pool). A thread holding a lock (allocator,
+        logging, ...) while the process forks leaves that lock held forever in the child. """
+    if profiler is None:
+        profiler = NullProfiler()
+    arguments = list(arguments)
+    sequential = num_workers <= 1 or len(arguments) <= 1 or not can_fork() or \
+        any(tensor.is_cuda for tensor in tensors)
+    if not sequential and threading.active_count() > 1:
+        warnings.warn(f"Running the {name} in this process instead of {num_workers} workers: "
+                      "forking while other threads are running can deadlock the workers")
+        sequential = True
+    if sequential:
+        return [function(argument) for argument in profiler.iterate(name, arguments)]
+
+    global _function
+    with _lock:
+        _function = function
+        try:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(num_workers, len(arguments)), initializer=_initialize_worker) as pool:
+                return list(profiler.iterate(name, pool.imap(_call, arguments), total=len(arguments)))
+        finally:
+            _function = None
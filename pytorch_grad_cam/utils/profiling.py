@@ -0,0 +1,133 @@
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+import tqdm
+
+
+class NullProfiler:
+    """ The default profiler of every CAM, measures nothing.
+        iterate() shows the tqdm progress bar of the channel batch loops. """
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def iterate(self, name, iterable, total=None):
+        return tqdm.tqdm(iterable, total=total)
+
+
+def _resident_bytes():
+    """ Resident memory of this process, None where /proc isn't available. """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class PhaseProfiler(NullProfiler):
+    """ Records the wall time and the allocated bytes of every phase of a CAM call:
+            cam.profiler = PhaseProfiler()
+            cam(input_tensor)
+            print(cam.profiler.format_summary())
+
+        Phases: forward, targets, backward, get_cam_image, get_cam_weights,
+        eigen_projection, scale_cam_image and aggregate_multi_layers, plus one record
+        per batch of the ScoreCAM / AblationCAM channel loops. Nested phases are
+        named by their path, e.g. 'get_cam_image/get_cam_weights'.
+
+        The allocated bytes are the change of torch.cuda.memory_allocated on the gpu,
+        and the change of the resident memory of the process on the cpu (Linux only).
+        callback, if given, is called with every record when its phase ends.
+        With progress=False the channel loops run without a tqdm bar. """
+
+    def __init__(self, callback=None, device=None, progress=False):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.callback = callback
+        self.progress = progress
+        self.records = []
+        self.stack = []
+
+    def allocated_bytes(self):
+        if self.device.type == 'cuda':
+            return torch.cuda.memory_allocated(self.device)
+        return _resident_bytes()
+
+    def synchronize(self):
+        # Time the gpu work of the phase, not only its launch
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def start(self, name):
+        self.stack.append(name)
+        self.synchronize()
+        return '/'.join(self.stack), self.allocated_bytes(), time.perf_counter()
+
+    def finish(self, started, record=True):
+        path, allocated_before, since = started
+        self.synchronize()
+        seconds = time.perf_counter() - since
+        allocated_after = self.allocated_bytes()
+        self.stack.pop()
+        if not record:
+            return
+        record = {'phase': path,
+                  'seconds': seconds,
+                  'allocated_bytes': None if allocated_before is None
+                  else allocated_after - allocated_before}
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    @contextmanager
+    def phase(self, name):
+        started = self.start(name)
+        try:
+            yield
+        finally:
+            self.finish(started)
+
+    def iterate(self, name, iterable, total=None):
+        """ One record per item, covering fetching the item and the loop body. """
+        if self.progress:
+            iterable = tqdm.tqdm(iterable, total=total)
+        iterator = iter(iterable)
+        while True:
+            started = self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.finish(started, record=False)
+                return
+            try:
+                yield item
+            finally:
+                self.finish(started)
+
+    def reset(self):
+        self.records = []
+
+    def summary(self):
+        """ Total seconds, calls and allocated bytes per phase, in the order they first ran. """
+        result = OrderedDict()
+        for record in self.records:
+            entry = result.setdefault(record['phase'], {'seconds': 0.0, 'calls': 0, 'allocated_bytes': 0})
+            entry['seconds'] += record['seconds']
+            entry['calls'] += 1
+            if record['allocated_bytes'] is None:
+                entry['allocated_bytes'] = None
+            elif entry['allocated_bytes'] is not None:
+                entry['allocated_bytes'] += record['allocated_bytes']
+        return result
+
+    def format_summary(self):
+        lines = [f'{"phase":<45} {"calls":>6} {"seconds":>9} {"MB":>9}']
+        for phase, entry in self.summary().items():
+            megabytes = '' if entry['allocated_bytes'] is None else f'{entry["allocated_bytes"] / 2 ** 20:.1f}'
+            lines.append(f'{phase:<45} {entry["calls"]:>6} {entry["seconds"]:>9.4f} {megabytes:>9}')
+        return '\n'.join(lines)
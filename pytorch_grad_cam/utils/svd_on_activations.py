@@ -1,19 +1,93 @@
+import warnings
+
 import numpy as np
+import torch
+
+
+def get_2d_projection(activation_batch, method='svd', tol=None, max_iter=100):
+    """ Projects the (B, C, H, W) activations on their first principal component,
+        returning (B, H, W) maps, for the whole batch at once.
+
+        method:
+            'svd': batched reduced np.linalg.svd on the cpu, the same result (and sign)
+                   as the full SVD per image this used to run.
+            'power': power iteration on the C x C covariance, on the device of the
+                     activations. Stops once the component changes by less than tol
+                     (default 1e-6), warns if that doesn't happen within max_iter (>= 1) steps.
+            'randomized': randomized SVD on the device of the activations, with max_iter
+                          subspace iterations (at most 4). It has no stopping
+                          criterion, so tol can't be given.
+        The sign of a principal component is arbitrary, and the maps are clipped at 0
+        afterwards, so it matters. 'svd' keeps the sign the SVD returns, like before.
+        'power' and 'randomized' have no such reference, their component is flipped
+        so that its entries sum to a positive value. Their maps can therefore be
+        the negated 'svd' maps.
+
+        NumPy input returns a float32 array, torch input a float32 tensor.
+        The input is not modified. """
+    is_numpy = not torch.is_tensor(activation_batch)
+    if is_numpy:
+        activation_batch = torch.from_numpy(np.ascontiguousarray(activation_batch))
+    activation_batch = torch.nan_to_num(activation_batch, nan=0.0)
+
+    batch_size, channels = activation_batch.shape[:2]
+    # (B, H*W, C)
+    reshaped_activations = activation_batch.reshape(batch_size, channels, -1).transpose(1, 2)
+    # Centering before the SVD seems to be important here,
+    # Otherwise the image returned is negative
+    reshaped_activations = reshaped_activations - \
+        reshaped_activations.mean(dim=1, keepdim=True)
+
+    if method == 'svd':
+        # NumPy's LAPACK: torch's SVD can return the opposite sign for the same matrix
+        _, _, VT = np.linalg.svd(reshaped_activations.cpu().numpy(), full_matrices=False)
+        component = torch.from_numpy(VT[:, 0, :]).to(reshaped_activations.device)
+    elif method == 'power':
+        if max_iter < 1:
+            raise ValueError(f"max_iter must be at least 1, got {max_iter}")
+        component = _power_iteration(reshaped_activations, 1e-6 if tol is None else tol, max_iter)
+        component = _orient(component)
+    elif method == 'randomized':
+        if tol is not None:
+            raise ValueError("The 'randomized' method runs a fixed number of iterations, "
+                             "it doesn't support tol")
+        q = min(6, *reshaped_activations.shape[1:])
+        _, _, V = torch.svd_lowrank(reshaped_activations, q=q, niter=min(max_iter, 4))
+        component = _orient(V[:, :, 0])
+    else:
+        raise ValueError(f"Unknown projection method {method}, "
+                         "expected 'svd', 'power' or 'randomized'")
+
+    projections = reshaped_activations @ component[:, :, None]
+    projections = projections.reshape(batch_size, *activation_batch.shape[2:]).float()
+    if is_numpy:
+        return projections.cpu().numpy()
+    return projections
+
+
+def _orient(component):
+    """ Flip every component so that its entries sum to a positive value,
+        independent of the random start. """
+    return component * torch.where(component.sum(dim=1, keepdim=True) < 0, -1, 1)
 
 
-def get_2d_projection(activation_batch):
-    # TBD: use pytorch batch svd implementation
-    activation_batch[np.isnan(activation_batch)] = 0
-    projections = []
-    for activations in activation_batch:
-        reshaped_activations = (activations).reshape(
-            activations.shape[0], -1).transpose()
-        # Centering before the SVD seems to be important here,
-        # Otherwise the image returned is negative
-        reshaped_activations = reshaped_activations - \
-            reshaped_activations.mean(axis=0)
-        U, S, VT = np.linalg.svd(reshaped_activations, full_matrices=True)
-        projection = reshaped_activations @ VT[0, :]
-        projection = projection.reshape(activations.shape[1:])
-        projections.append(projection)
-    return np.float32(projections)
+def _power_iteration(reshaped_activations, tol, max_iter):
+    """ Leading right singular vector of every (H*W, C) matrix in the batch. """
+    covariance = reshaped_activations.transpose(1, 2) @ reshaped_activations
+    # Start from the row sums of the covariance, covariance @ ones, a dense and
+    # deterministic vector. Its projection on the leading component is the
+    # leading eigenvalue times the sum of the component's entries, so it is only
+    # orthogonal to the component if those sum to exactly 0.
+    component = covariance.sum(dim=2)
+    component = component / component.norm(dim=1, keepdim=True).clamp(min=1e-12)
+    for _ in range(max_iter):
+        next_component = (covariance @ component[:, :, None])[:, :, 0]
+        next_component = next_component / next_component.norm(dim=1, keepdim=True).clamp(min=1e-12)
+        sign = torch.sign((next_component * component).sum(dim=1, keepdim=True))
+        change = (next_component - sign * component).norm(dim=1)
+        component = next_component
+        if change.max() < tol:
+            return component
+    warnings.warn(f"The power iteration did not converge to tol={tol} in {max_iter} iterations, "
+                  f"the largest change of the last step was {change.max().item():.2e}")
+    return component
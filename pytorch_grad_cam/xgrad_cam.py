@@ -23,7 +23,7 @@ class XGradCAM(BaseCAM):
                         target_category,
                         activations,
                         grads):
-        sum_activations = np.sum(activations, axis=(2, 3))
+        sum_activations = activations.sum(axis=(2, 3))
         eps = 1e-7
         weights = grads * activations / \
             (sum_activations[:, :, None, None] + eps)
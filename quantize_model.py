@@ -0,0 +1,95 @@
+""" INT8 post-training static quantization of the retrained ResNet for CPU inference.
+
+The float weights are copied into torchvision's quantizable ResNet-18, Conv+BN+ReLU
+are fused, the observers are calibrated on the 'test' split of the ImageFolder layout
+and the model is converted to INT8. The quantized model is only written if its
+sensitivity and specificity stay within --max-drop percentage points of the float model.
+
+Example:
+    python quantize_model.py --data-dir chest_xray/ --output models/FULLRetrainedResNetModel-int8.ts
+"""
+import argparse
+import os
+import sys
+
+import torch
+import torchvision
+from torchvision import datasets
+
+import model_registry
+
+
+def sensitivity_specificity(model, dataloader):
+    """ Same metrics as test_model in PyTorchGradCAM-FINAL.py, PNEUMONIA is the positive class. """
+    tp = tn = fp = fn = 0
+    with torch.no_grad():
+        for images, labels in dataloader:
+            preds = torch.argmax(model(images), 1)
+            tp += int(((preds == 1) & (labels == 1)).sum())
+            tn += int(((preds == 0) & (labels == 0)).sum())
+            fp += int(((preds == 1) & (labels == 0)).sum())
+            fn += int(((preds == 0) & (labels == 1)).sum())
+    sensitivity = 100 * tp / max(tp + fn, 1)
+    specificity = 100 * tn / max(tn + fp, 1)
+    return sensitivity, specificity
+
+
+def quantize(float_model, calibration_loader, calibration_batches=None, backend='fbgemm'):
+    torch.backends.quantized.engine = backend
+    model = torchvision.models.quantization.resnet18(num_classes=float_model.fc.out_features)
+    model.load_state_dict(float_model.state_dict())
+    model.eval()
+    model.fuse_model()
+    model.qconfig = torch.ao.quantization.get_default_qconfig(backend)
+    torch.ao.quantization.prepare(model, inplace=True)
+
+    # Let the observers record the activation ranges
+    with torch.no_grad():
+        for i, (images, labels) in enumerate(calibration_loader):
+            if calibration_batches is not None and i >= calibration_batches:
+                break
+            model(images)
+
+    torch.ao.quantization.convert(model, inplace=True)
+    return model
+
+
+def main(argv=None):
+    default_backend = 'fbgemm' if 'fbgemm' in torch.backends.quantized.supported_engines else 'qnnpack'
+    parser = argparse.ArgumentParser(description='INT8 static quantization with an accuracy gate.')
+    parser.add_argument('--data-dir', required=True, help="Directory with the 'test' ImageFolder split")
+    parser.add_argument('--model', default=model_registry.MODEL_PATH)
+    parser.add_argument('--output', default='models/FULLRetrainedResNetModel-int8.ts')
+    parser.add_argument('--max-drop', type=float, default=1.0,
+                        help='Maximum allowed drop of sensitivity or specificity, in percentage points')
+    parser.add_argument('--calibration-batches', type=int, default=None,
+                        help='Only calibrate on the first N batches of the test split')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--backend', default=default_backend, choices=torch.backends.quantized.supported_engines)
+    args = parser.parse_args(argv)
+
+    image_dataset = datasets.ImageFolder(os.path.join(args.data_dir, 'test'), model_registry.data_transforms['test'])
+    dataloader = torch.utils.data.DataLoader(image_dataset, batch_size=args.batch_size,
+                                             shuffle=False, num_workers=args.num_workers)
+
+    # Quantized kernels only run on the cpu
+    float_model = model_registry.load_model(args.model, torch.device('cpu'))
+    quantized_model = quantize(float_model, dataloader, args.calibration_batches, args.backend)
+
+    float_sensitivity, float_specificity = sensitivity_specificity(float_model, dataloader)
+    int8_sensitivity, int8_specificity = sensitivity_specificity(quantized_model, dataloader)
+    print(f'- Sensitivity : float {float_sensitivity:.3f}, int8 {int8_sensitivity:.3f}')
+    print(f'- Specificity : float {float_specificity:.3f}, int8 {int8_specificity:.3f}')
+
+    if (float_sensitivity - int8_sensitivity > args.max_drop
+            or float_specificity - int8_specificity > args.max_drop):
+        print(f'Quantized model drops more than {args.max_drop} points, not writing {args.output}')
+        sys.exit(1)
+
+    torch.jit.save(torch.jit.script(quantized_model), args.output)
+    print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
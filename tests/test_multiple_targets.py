@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import torch
+from torchvision.models import resnet18
+
+from pytorch_grad_cam import GradCAM
+from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return resnet18(num_classes=2).eval()
+
+
+def batched_grad_raising(message):
+    grad = torch.autograd.grad
+
+    def autograd_grad(*args, **kwargs):
+        if kwargs.get('is_grads_batched'):
+            raise RuntimeError(message)
+        return grad(*args, **kwargs)
+    return autograd_grad
+
+
+def test_multiple_targets_match_single_targets(model):
+    input_tensor = torch.rand(2, 3, 64, 64)
+    with GradCAM(model, [model.layer4[-1]]) as cam:
+        maps = cam(input_tensor, targets=[[ClassifierOutputTarget(0), ClassifierOutputTarget(1)]] * 2)
+        assert maps.shape == (2, 2, 64, 64)
+        for target in range(2):
+            single = cam(input_tensor, targets=[ClassifierOutputTarget(target)] * 2)
+            np.testing.assert_allclose(maps[:, target], single, atol=1e-5)
+
+
+def test_falls_back_without_batching_rule(model, monkeypatch):
+    input_tensor = torch.rand(2, 3, 64, 64)
+    targets = [[ClassifierOutputTarget(0), ClassifierOutputTarget(1)]] * 2
+    with GradCAM(model, [model.layer4[-1]]) as cam:
+        expected = cam(input_tensor, targets=targets)
+        monkeypatch.setattr(torch.autograd, "grad",
+                            batched_grad_raising("Batching rule not implemented for aten::foo"))
+        np.testing.assert_allclose(cam(input_tensor, targets=targets), expected, atol=1e-5)
+
+
+def test_other_errors_are_raised(model, monkeypatch):
+    monkeypatch.setattr(torch.autograd, "grad", batched_grad_raising("CUDA out of memory"))
+    with GradCAM(model, [model.layer4[-1]]) as cam:
+        with pytest.raises(RuntimeError, match="out of memory"):
+            cam(torch.rand(2, 3, 64, 64), targets=[[ClassifierOutputTarget(0), ClassifierOutputTarget(1)]] * 2)
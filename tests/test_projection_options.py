@@ -0,0 +1,41 @@
+import pytest
+import torch
+from torchvision.models import resnet18
+
+from pytorch_grad_cam import AblationCAM, AblationLayer, EigenCAM, GradCAM, FullGrad
+from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return resnet18(num_classes=2).eval()
+
+
+def test_eigen_cam_uses_projection_method(model, monkeypatch):
+    calls = []
+    import pytorch_grad_cam.base_cam as base_cam
+    import pytorch_grad_cam.ablation_layer as ablation_layer
+    original = base_cam.get_2d_projection
+
+    def recording_projection(activations, method='svd', tol=None, max_iter=100):
+        calls.append((method, tol))
+        return original(activations, method=method, tol=tol, max_iter=max_iter)
+
+    monkeypatch.setattr(base_cam, "get_2d_projection", recording_projection)
+    monkeypatch.setattr(ablation_layer, "get_2d_projection", recording_projection)
+    input_tensor = torch.rand(2, 3, 64, 64)
+    cam = EigenCAM(model, [model.layer4[-1]])
+    cam.projection_method = 'power'
+    cam.projection_tol = 1e-5
+    cam(input_tensor)
+    cam = GradCAM(model, [model.layer4[-1]])
+    cam.projection_method = 'randomized'
+    cam(input_tensor, targets=[ClassifierOutputTarget(0)] * 2, eigen_smooth=True)
+    cam = FullGrad(model, [])
+    cam.projection_method = 'power'
+    cam(input_tensor, targets=[ClassifierOutputTarget(0)] * 2, eigen_smooth=True)
+    cam = AblationCAM(model, [model.layer4[-1]], ablation_layer=AblationLayer(), ratio_channels_to_ablate=0.05)
+    cam.projection_method = 'randomized'
+    cam(input_tensor[:1], targets=[ClassifierOutputTarget(0)])
+    assert calls == [('power', 1e-5), ('randomized', None), ('power', None), ('randomized', None)]
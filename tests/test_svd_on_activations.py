@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+import torch
+
+from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection
+
+
+def reference_projection(activation_batch):
+    """ The per-image full SVD get_2d_projection used to run. """
+    activation_batch = activation_batch.copy()
+    activation_batch[np.isnan(activation_batch)] = 0
+    projections = []
+    for activations in activation_batch:
+        reshaped_activations = activations.reshape(activations.shape[0], -1).transpose()
+        reshaped_activations = reshaped_activations - reshaped_activations.mean(axis=0)
+        U, S, VT = np.linalg.svd(reshaped_activations, full_matrices=True)
+        projection = reshaped_activations @ VT[0, :]
+        projections.append(projection.reshape(activations.shape[1:]))
+    return np.float32(projections)
+
+
+def make_activations(batch_size, channels, height, width, seed=0):
+    """ ReLU-like activations with a dominant component, like the ones of a trained CNN. """
+    generator = torch.Generator().manual_seed(seed)
+    spatial = torch.rand(batch_size, 1, height * width, generator=generator)
+    loadings = torch.rand(batch_size, channels, 1, generator=generator)
+    noise = 0.1 * torch.rand(batch_size, channels, height * width, generator=generator)
+    return (loadings * spatial + noise).reshape(batch_size, channels, height, width).numpy()
+
+
+def assert_close_up_to_sign(projections, reference, atol):
+    for projection, expected in zip(projections, reference):
+        sign = 1 if np.sum(projection * expected) >= 0 else -1
+        np.testing.assert_allclose(sign * projection, expected, atol=atol)
+
+
+# (C, H, W): more channels than pixels like layer4 of a ResNet, and the other way around
+SHAPES = [(512, 7, 7), (64, 28, 28), (3, 5, 4)]
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_svd_matches_reference_with_sign(shape):
+    activations = make_activations(3, *shape)
+    np.testing.assert_allclose(get_2d_projection(activations), reference_projection(activations), atol=1e-4)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("method", ['power', 'randomized'])
+def test_methods_match_reference_up_to_sign(shape, method):
+    activations = make_activations(3, *shape)
+    projections = get_2d_projection(activations, method=method)
+    assert_close_up_to_sign(projections, reference_projection(activations), atol=1e-3)
+
+
+@pytest.mark.parametrize("method", ['power', 'randomized'])
+def test_methods_orient_component_positive(method):
+    activations = make_activations(2, 64, 8, 8)
+    projections = get_2d_projection(activations, method=method)
+    # The dominant component loads positively on every channel, so the
+    # oriented projection is large where the shared spatial pattern is large
+    spatial = activations.mean(axis=1).reshape(2, -1)
+    for projection, pattern in zip(projections.reshape(2, -1), spatial):
+        assert np.corrcoef(projection, pattern)[0, 1] > 0.9
+
+
+def test_numpy_and_tensor_input():
+    activations = make_activations(2, 16, 6, 6)
+    projections = get_2d_projection(activations)
+    assert isinstance(projections, np.ndarray)
+    assert projections.dtype == np.float32
+    assert projections.shape == (2, 6, 6)
+
+    tensor_projections = get_2d_projection(torch.from_numpy(activations))
+    assert torch.is_tensor(tensor_projections)
+    assert tensor_projections.dtype == torch.float32
+    np.testing.assert_allclose(tensor_projections.numpy(), projections, atol=1e-6)
+
+
+def test_nan_is_zeroed_without_modifying_the_input():
+    activations = make_activations(1, 16, 6, 6)
+    activations[0, 0, 0, 0] = np.nan
+    original = activations.copy()
+    projections = get_2d_projection(activations)
+    np.testing.assert_array_equal(activations, original)
+    assert np.isfinite(projections).all()
+    np.testing.assert_allclose(projections, reference_projection(activations), atol=1e-4)
+
+
+def test_randomized_rejects_tol():
+    with pytest.raises(ValueError):
+        get_2d_projection(make_activations(1, 16, 6, 6), method='randomized', tol=1e-3)
+
+
+def test_power_warns_when_not_converged():
+    activations = torch.rand(1, 32, 6, 6, generator=torch.Generator().manual_seed(0)).numpy()
+    with pytest.warns(UserWarning, match="did not converge"):
+        get_2d_projection(activations, method='power', tol=0, max_iter=1)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        get_2d_projection(make_activations(1, 16, 6, 6), method='qr')
+
+
+def test_power_rejects_max_iter_below_one():
+    with pytest.raises(ValueError):
+        get_2d_projection(make_activations(1, 16, 6, 6), method='power', max_iter=0)
+
+
+def test_power_start_is_not_orthogonal_to_the_component():
+    # The leading component doesn't load on the channel with the largest variance:
+    # a start from that channel's covariance row would be exactly orthogonal to it
+    checkerboard = torch.tensor([1.0, -1.0]).repeat(32)
+    stripes = torch.tensor([1.0, 1.0, -1.0, -1.0]).repeat(16)
+    activations = torch.cat([3.0 * checkerboard[None], stripes[None].expand(15, -1)])
+    activations = activations.reshape(1, 16, 8, 8)
+    projections = get_2d_projection(activations, method='power')
+    assert_close_up_to_sign(projections.numpy(), reference_projection(activations.numpy()), atol=1e-3)